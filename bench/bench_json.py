@@ -0,0 +1,65 @@
+"""CPU time per MB of JSON for the old decoding path (r.text + json.loads, json.dumps to str)
+and for every available codec (loads from bytes, dumps to bytes).
+
+Usage: python bench/bench_json.py [seconds per measurement]
+"""
+import json
+import os
+import sys
+import time
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json_codec
+from bench_xml import _fby_order, _order
+
+
+def _response(payload: bytes, content_type: str) -> requests.Response:
+    response = requests.Response()
+    response._content = payload
+    response._content_consumed = True
+    response.status_code = 200
+    response.headers['Content-Type'] = content_type
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    return response
+
+def _pages() -> dict:
+    prices = {'offers': [{'offerId': 'SKU-%s' % i, 'price': {'value': 1000 + i, 'currencyId': 'RUR', 'discountBase': 1200 + i}}
+                         for i in range(500)]}
+    return {
+        'stats/orders page (200 orders)': {'status': 'OK', 'result': {'orders': [_fby_order(i) for i in range(200)], 'paging': {'nextPageToken': 'abc'}}},
+        'orders page (50 orders)': {'orders': [_order(i) for i in range(50)], 'pager': {'total': 50, 'from': 1, 'to': 50}},
+        'set_prices body (500 offers)': prices,
+    }
+
+def _cpu_per_mb(action, size: int, seconds: float) -> float:
+    """Repeat action for at least seconds of CPU time, the process clock is too coarse for one page."""
+    rounds = 0
+    started = time.process_time()
+    while True:
+        action()
+        rounds += 1
+        elapsed = time.process_time() - started
+        if elapsed >= seconds:
+            return elapsed / rounds / (size / 1024 / 1024)
+
+
+def run(seconds: float):
+    for name, page in _pages().items():
+        payload = json.dumps(page, ensure_ascii=False).encode('utf-8')
+        size = len(payload)
+        print('%s: %.2f MB' % (name, size / 1024 / 1024))
+
+        response = _response(payload, 'application/json;charset=UTF-8')
+        print('  decode  %-40s %7.1f ms/MB' % ('json.loads(r.text)', 1000 * _cpu_per_mb(lambda: json.loads(response.text), size, seconds)))
+        for codec in json_codec.CODECS.values():
+            print('  decode  %-40s %7.1f ms/MB' % (codec.name + '.loads(r.content)', 1000 * _cpu_per_mb(lambda: codec.loads(payload), size, seconds)))
+
+        print('  encode  %-40s %7.1f ms/MB' % ('json.dumps -> str', 1000 * _cpu_per_mb(lambda: json.dumps(page), size, seconds)))
+        for codec in json_codec.CODECS.values():
+            print('  encode  %-40s %7.1f ms/MB' % (codec.name + ' dumps -> bytes', 1000 * _cpu_per_mb(lambda: codec.dumps(page), size, seconds)))
+
+
+if __name__ == '__main__':
+    run(float(sys.argv[1]) if len(sys.argv) > 1 else 0.5)
@@ -0,0 +1,44 @@
+"""Compare connections opened by bare requests calls and by the pooled transport.
+
+Usage: python bench/bench_transport.py [calls]
+"""
+import os
+import sys
+import time
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_server import StubServer
+from yandex import get_query, post_query
+
+
+def run(calls: int):
+    server = StubServer({'result': {'orders': []}}).start()
+    headers = {'Content-Type': 'application/json'}
+
+    started = time.perf_counter()
+    for _ in range(calls):
+        requests.post(server.url + '/stats/orders.json', data='{}', headers=headers)
+    plain_time = time.perf_counter() - started
+    plain_connections = server.connections
+
+    server.reset()
+    started = time.perf_counter()
+    for i in range(calls):
+        if i % 2:
+            get_query(server.url + '/orders/1.json', headers)
+        else:
+            post_query(server.url + '/stats/orders.json', {}, headers)
+    pooled_time = time.perf_counter() - started
+    pooled_connections = server.connections
+
+    print('calls: %s' % calls)
+    print('requests.*   connections %5s  %.3f s' % (plain_connections, plain_time))
+    print('transport    connections %5s  %.3f s' % (pooled_connections, pooled_time))
+    print('handshakes saved per run: %s' % (plain_connections - pooled_connections))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,93 @@
+"""Check that the compiled serializer matches the original one byte for byte and compare their speed.
+
+The samples avoid '&', '<' and '>', which the current _unicode_filter escapes and the original did not.
+
+Usage: python bench/bench_xml.py [orders]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import legacy_xml
+from methods import Method
+from yandex import json_to_xml
+
+
+def _order(i: int) -> dict:
+    return {
+        '_edit': 1,
+        'id': 100000 + i, 'status': 'PROCESSING', 'substatus': 'STARTED', 'creationDate': '01-02-2023 10:11:12',
+        'currency': 'RUR', 'itemsTotal': 1500.0, 'total': 1700.0, 'deliveryTotal': 200.0, 'paymentType': 'PREPAID',
+        'paymentMethod': 'YANDEX', 'fake': False, 'notes': 'Позвонить – «заранее»', 'taxSystem': 'OSN',
+        'delivery': {
+            'id': 'd%s' % i, 'price': 200, 'deliveryPartnerType': 'YANDEX_MARKET', 'serviceName': 'Доставка', 'type': 'DELIVERY',
+            'dates': {'fromDate': '02-02-2023', 'toDate': '03-02-2023', 'fromTime': '10:00'},
+            'region': {'id': 213, 'type': 'CITY', 'name': 'Москва'},
+            'address': {'country': 'Россия', 'city': 'Москва', 'street': 'Льва Толстого', 'house': '16', 'recipient': 'Иванов Иван'},
+            'shipments': [{'id': 7 + i, 'shipmentDate': '02-02-2023', 'status': 'NEW', 'weight': 1200,
+                           'boxes': [{'id': b, 'fulfilmentId': '%s-%s' % (i, b), 'weight': 600, 'width': 10, 'height': 20, 'depth': 30} for b in range(2)]}],
+        },
+        'buyer': {'id': 'b%s' % i, 'lastName': 'Иванов', 'firstName': 'Иван', 'type': 'PERSON'},
+        'items': [{'id': n, 'offerId': 'SKU-%s' % n, 'count': 1 + n, 'price': 500.0, 'vat': 'VAT_20',
+                   'promos': [{'marketPromoId': 'p1', 'subsidy': 10, 'type': 'MARKET_COUPON'}],
+                   'subsidies': [{'amount': 10, 'type': 'SUBSIDY'}]} for n in range(3)],
+    }
+
+def _fby_order(i: int) -> dict:
+    return {
+        '_campaign': 'main', 'id': 200000 + i, 'creationDate': '2023-02-01', 'status': random.choice(('DELIVERED', 'RETURNED')),
+        'statusUpdateDate': '2023-02-05T10:00:00', 'paymentType': 'PREPAID' if i % 3 else '',
+        'items': [{'shopSku': 'Товар «%s» — %s' % (i, n), 'marketSku': 1000 + n, 'count': 1,
+                   'prices': [{'type': 'BUYER', 'costPerItem': 500, 'total': 500}, {'type': 'MARKETPLACE', 'costPerItem': 0, 'total': 0}]}
+                  for n in range(4)],
+    }
+
+def _samples(count: int) -> list:
+    return [
+        (Method.FBY_GET_ORDERS, [_fby_order(i) for i in range(count)]),
+        (Method.GET_ORDER_INFO, _order(1)),
+        (Method.FBS_SET_BOXES, {'order': 5, 'boxes': _order(1)['delivery']['shipments'][0]['boxes']}),
+        (Method.GET_BUYER_INFO, {'order': 5, 'id': 'b', 'lastName': 'Иванов', 'phone': '+7 900'}),
+        (Method.SET_PRICES, {'_batch': 3, 'status': 'ERROR', 'errors': [{'code': 'BAD', 'message': 'Цена «0»'}]}),
+        (Method.DBS_GET_ORDERS_FOR_CANCELLATION_APPROVE, [{'id': 1, 'status': 'CANCELLED', 'substatus': ''}]),
+        (Method.DBS_CHANGE_DATE, {'order': 4, '_x': 1}),
+        (Method.YD_CREATE_OFFER, {'_p': 1, 'operator_request_id': 'r1', 'request_id': 'abc'}),
+        (Method.YD_CREATE_OFFER, {'error_details': ['late', 'far']}),
+        (Method.YD_OFFER_INFO, {'request_id': 'abc', 'status': 'DELIVERED', 'total_without_vat': 100}),
+    ]
+
+def _render(serializer, method, payload) -> str:
+    xml = []
+    serializer(method, payload, xml)
+    return '\n'.join(xml)
+
+def _timed(serializer, method, payload, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        serializer(method, payload, [])
+    return (time.perf_counter() - started) / rounds
+
+
+def run(count: int):
+    for method, payload in _samples(count):
+        if _render(legacy_xml.json_to_xml, method, payload) != _render(json_to_xml, method, payload):
+            print('MISMATCH %s' % method.value)
+            sys.exit(1)
+    print('output identical for all sample methods')
+
+    fby_orders = [_fby_order(i) for i in range(count)]
+    orders = [_order(i) for i in range(count)]
+    for title, method, payload in (('fby_get_orders, %s orders' % count, Method.FBY_GET_ORDERS, fby_orders),):
+        legacy = _timed(legacy_xml.json_to_xml, method, payload, 5)
+        compiled = _timed(json_to_xml, method, payload, 5)
+        print('%-32s legacy %.4f s  compiled %.4f s  x%.2f' % (title, legacy, compiled, legacy / compiled))
+    legacy = _timed(lambda m, p, x: [legacy_xml.json_to_xml(m, o, x) for o in p], Method.GET_ORDER_INFO, orders, 5)
+    compiled = _timed(lambda m, p, x: [json_to_xml(m, o, x) for o in p], Method.GET_ORDER_INFO, orders, 5)
+    print('%-32s legacy %.4f s  compiled %.4f s  x%.2f' % ('get_order_info, %s orders' % count, legacy, compiled, legacy / compiled))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
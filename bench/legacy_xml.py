@@ -0,0 +1,219 @@
+"""Reference copy of the original hand-written serializer, used by bench_xml.py for output and speed comparison."""
+from methods import Method
+from datetime import datetime
+
+unicode_replace = {u"\u2013": "-",u"\u2014": "-",u"\xab": '"',u"\xbb": '"',u"\xf6": 'o',u"\xca": 'e'}
+
+def _unicode_filter(param):
+    tmp = str(param)
+    for u in unicode_replace:
+        if tmp.find(u) != -1:
+            tmp = tmp.replace(u, unicode_replace[u])
+    return tmp
+
+
+def _order_to_xml(json_data, xml_data: list):
+    xml_data.append(' <order>')
+    for param in json_data.keys():
+        if param.startswith('_'):
+            xml_data.append('  <%s>%s</%s>' % (param, _unicode_filter(json_data[param]) ,param))    
+    for param in ('id','status','substatus','creationDate','currency','itemsTotal','total','deliveryTotal','subsidyTotal','paymentType','paymentMethod','fake','notes','taxSystem'):
+        if param in json_data:
+            xml_data.append('  <%s>%s</%s>' % (param, _unicode_filter(json_data[param]), param))
+    xml_data.append('  <delivery>')
+    for param in ('id','price','deliveryPartnerType','deliveryServiceId','serviceName','type','dispatchType'):
+        if param in json_data['delivery']:
+            xml_data.append('   <%s>%s</%s>' % (param, _unicode_filter(json_data['delivery'][param]), param))
+    xml_data.append('   <dates>')
+    for param in ('fromDate','toDate','fromTime','toTime'):
+        if param in json_data['delivery']['dates']:
+            xml_data.append('    <%s>%s</%s>' % (param, _unicode_filter(json_data['delivery']['dates'][param]), param))
+    xml_data.append('   </dates>')    
+    xml_data.append('   <region>')
+    for param in ('id','type','name'):
+        if param in json_data['delivery']['region']:
+            xml_data.append('    <%s>%s</%s>' % (param, _unicode_filter(json_data['delivery']['region'][param]), param))
+    xml_data.append('   </region>')
+    if 'address' in json_data['delivery']:
+        xml_data.append('   <address>')
+        for param in ('country','postcode','city','street','house','block','recipient'):
+            if param in json_data['delivery']['address']:
+                xml_data.append('    <%s>%s</%s>' % (param, _unicode_filter(json_data['delivery']['address'][param]), param))
+        xml_data.append('   </address>')
+    xml_data.append('   <shipments>')
+    for shipment in json_data['delivery']['shipments']:
+        xml_data.append('    <shipment>')
+        for param in ('id','shipmentDate','shipmentTime','status','weight','width','height','depth'):
+            if param in shipment:
+                xml_data.append('     <%s>%s</%s>' % (param, _unicode_filter(shipment[param]), param))    
+        if 'boxes' in shipment:
+            xml_data.append('     <boxes>')
+            for box in shipment['boxes']:
+                xml_data.append('      <box>')
+                for box_param in ('id','fulfilmentId','weight','width','height','depth'):
+                    if box_param in box:
+                        xml_data.append('       <%s>%s</%s>' % (box_param, _unicode_filter(box[box_param]), box_param))    
+                xml_data.append('      </box>')
+            xml_data.append('     </boxes>')
+        xml_data.append('    </shipment>')
+    xml_data.append('   </shipments>')
+    xml_data.append('  </delivery>')
+    if 'buyer' in json_data:
+        xml_data.append('  <buyer>')
+        for param in ('id','lastName','firstName','middleName','type'):
+            if param in json_data['buyer']:
+                xml_data.append('   <%s>%s</%s>' % (param, _unicode_filter(json_data['buyer'][param]), param))
+        xml_data.append('  </buyer>')
+    
+    xml_data.append('  <items>')
+    for item in json_data['items']:
+        xml_data.append('   <item>')
+        for param in ('id','offerId','count','price','vat','warehouseId','partnerWarehouseId','subsidy'):
+            if param in item:
+                xml_data.append('    <%s>%s</%s>' % (param, _unicode_filter(item[param]), param))    
+        if 'promos' in item:
+            xml_data.append('    <promos>')
+            for promo in item['promos']:
+                xml_data.append('     <promo>')
+                for param in ('marketPromoId','subsidy','type'):
+                    if param in promo:
+                        xml_data.append('      <%s>%s</%s>' % (param, _unicode_filter(promo[param]), param))    
+                xml_data.append('     </promo>')
+            xml_data.append('    </promos>')
+        if 'subsidies' in item:
+            xml_data.append('    <subsidies>')
+            for subsidy in item['subsidies']:
+                xml_data.append('     <subsidy>')
+                for param in ('amount','type'):
+                    if param in subsidy:
+                        xml_data.append('      <%s>%s</%s>' % (param, _unicode_filter(subsidy[param]), param))    
+                xml_data.append('     </subsidy>')
+            xml_data.append('    </subsidies>')
+        xml_data.append('   </item>')
+    xml_data.append('  </items>')
+    xml_data.append(' </order>')
+
+
+def json_to_xml(method: Method, json_data, xml_data: list):
+    if method is Method.FBY_GET_ORDERS:
+        for order in json_data:
+            xml_data.append(' <fby_order>')
+            for param in order.keys():
+                if param.startswith('_'):
+                    xml_data.append('  <param%s>%s</param%s>' % (param, _unicode_filter(order[param]) ,param))    
+            for param in ('id','creationDate','status','statusUpdateDate','paymentType'):
+                if param in order and order[param]:
+                    xml_data.append('  <%s>%s</%s>' % (param, _unicode_filter(order[param]) ,param))
+            xml_data.append('  <items>')
+            for item in order['items']:
+                xml_data.append('   <item>')
+                for param in ('shopSku','marketSku','count'):
+                    if param in item and item[param]:
+                        xml_data.append('    <%s>%s</%s>' % (param, _unicode_filter(item[param]) ,param))
+                xml_data.append('    <prices>')
+                for price in item['prices']:
+                    xml_data.append('     <price>')
+                    for price_param in ('type','costPerItem','total'):
+                        if price_param in price and price[price_param]:
+                            xml_data.append('      <%s>%s</%s>' % (price_param, _unicode_filter(price[price_param]) ,price_param))
+                    xml_data.append('     </price>')
+                xml_data.append('    </prices>')
+                xml_data.append('   </item>')
+            xml_data.append('  </items>')
+            xml_data.append(' </fby_order>')
+    
+    elif method is Method.FBS_SET_STATUS:
+        _order_to_xml(json_data, xml_data)
+    
+    elif method is Method.FBS_SET_BOXES:
+        xml_data.append('<order>')
+        xml_data.append(' <id>%s</id>' % _unicode_filter(json_data['order']))
+        xml_data.append(' <boxes>')
+        for box in json_data['boxes']:
+            xml_data.append('  <box>')
+            for param in ('id','fulfilmentId','weight','width','height','depth'):
+                if param in box:
+                    xml_data.append('   <%s>%s</%s>' % (param, _unicode_filter(box[param]) ,param))
+            xml_data.append('  </box>')
+        xml_data.append(' </boxes>')
+        xml_data.append('</order>')
+    
+    elif method is Method.GET_ORDER_INFO:
+        _order_to_xml(json_data, xml_data)
+
+    elif method is Method.GET_BUYER_INFO:
+        xml_data.append('<buyer-info>')
+        xml_data.append(' <order>%s</order>' % _unicode_filter(json_data['order']))
+        for param in ('id','lastName','firstName','middleName','phone'):
+            if param in json_data:
+                xml_data.append(' <%s>%s</%s>' % (param, _unicode_filter(json_data[param]) ,param))
+        xml_data.append('</buyer-info>')
+
+    elif method is Method.SET_PRICES:
+        xml_data.append('<set-prices>')
+        for param in json_data.keys():
+            if param.startswith('_'):
+                xml_data.append('<%s>%s</%s>' % (param, _unicode_filter(json_data[param]) ,param))    
+        xml_data.append(' <status>%s</status>' % json_data['status'])
+        if 'errors' in json_data:
+            xml_data.append(' <errors>')
+            for error in json_data['errors']:
+                xml_data.append('  <error>')
+                for param in ('code','message'):
+                    if param in error:
+                        xml_data.append('   <%s>%s</%s>' % (param, _unicode_filter(error[param]) ,param))
+                xml_data.append('  </error>')
+            xml_data.append(' </errors>')
+        
+        xml_data.append('</set-prices>')
+
+    elif method is Method.DBS_GET_ORDERS_FOR_CANCELLATION_APPROVE:
+        for order in json_data:
+            xml_data.append(' <dbs_order>')
+            for param in ('id','status','substatus'):
+                if param in order and order[param]:
+                    xml_data.append('  <%s>%s</%s>' % (param, _unicode_filter(order[param]) ,param))
+            xml_data.append(' </dbs_order>')
+    
+    elif method is Method.DBS_CHANGE_DATE:
+        xml_data.append(' <dbs_change_date>')
+        for param in json_data:
+            xml_data.append('  <%s>%s</%s>' % (param, _unicode_filter(json_data[param]) ,param))
+        xml_data.append(' </dbs_change_date>')
+    
+    elif method is Method.DBS_SET_STATUS:
+        _order_to_xml(json_data, xml_data)
+    
+    elif method is Method.YD_CREATE_OFFER:
+        xml_data.append('<yd-create-offer>')
+        for param in json_data.keys():
+            if param.startswith('_'):
+                xml_data.append('<%s>%s</%s>' % (param, _unicode_filter(json_data[param]) ,param))    
+        
+        if 'error_details' in json_data:
+            xml_data.append(' <errors>')
+            for error in json_data['error_details']:
+                xml_data.append('  <error>%s</error>' % _unicode_filter(error))
+            xml_data.append(' </errors>')
+        else:
+            for param in ('operator_request_id','pickup_interval_min','pickup_interval_max','request_id'):
+                if param in json_data:
+                    xml_data.append(' <%s>%s</%s>' % (param, _unicode_filter(json_data[param]), param))
+        
+        xml_data.append('</yd-create-offer>')
+
+    elif method is Method.YD_CANCEL_OFFER:
+        xml_data.append('<yd-cancel-offer>')
+        xml_data.append(' <request_id>%s</request_id>' % _unicode_filter(json_data['request_id']))
+        xml_data.append(' <timestamp>%s</timestamp>' % datetime.strftime(datetime.now(), "%d-%m-%Y %H:%M:%S"))
+        xml_data.append('</yd-cancel-offer>')
+
+    elif method is Method.YD_OFFER_INFO:
+        xml_data.append('<yd-offer-info>')
+        xml_data.append(' <request_id>%s</request_id>' % _unicode_filter(json_data['request_id']))
+        for param in ('timestamp','status','sharing_url','total_without_vat'):
+            if param in json_data:
+                xml_data.append(' <%s>%s</%s>' % (param, _unicode_filter(json_data[param]) ,param))
+        
+        xml_data.append('</yd-offer-info>')
+
@@ -0,0 +1,76 @@
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """Local keep-alive HTTP server answering every request with a fixed JSON body.
+
+    body may also be a callable taking (method, path, request body) and returning the JSON payload
+    or a (status, payload, headers) tuple.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, body: dict = None, status: int = 200):
+        self.body = body if callable(body) else json.dumps(body if body is not None else {'status': 'OK'}).encode('utf-8')
+        self.status = status
+        self.connections = 0
+        self.requests = 0
+        self._count_lock = threading.Lock()
+        super().__init__(('127.0.0.1', 0), _StubHandler)
+
+    def get_request(self):
+        request = super().get_request()
+        with self._count_lock:
+            self.connections += 1
+        return request
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:%s' % self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def reset(self):
+        with self._count_lock:
+            self.connections = 0
+            self.requests = 0
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _answer(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        request_body = self.rfile.read(length) if length else b''
+        with self.server._count_lock:
+            self.server.requests += 1
+        body, status, headers = self.server.body, self.server.status, {}
+        if callable(body):
+            body = body(self.command, self.path, request_body)
+            if isinstance(body, tuple):
+                status, body, headers = body
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _answer
+    do_POST = _answer
+    do_PUT = _answer
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,44 @@
+import json
+from typing import Callable, NamedTuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Codec(NamedTuple):
+    name: str
+    loads: Callable #bytes или str -> объект
+    dumps: Callable #объект -> bytes в utf-8
+
+
+def _json_dumps(obj) -> bytes:
+    return json.dumps(obj).encode('utf-8')
+
+def _orjson_dumps(obj) -> bytes:
+    try:
+        return orjson.dumps(obj)
+    except TypeError:
+        #orjson не принимает нестроковые ключи и целые больше 64 бит
+        return _json_dumps(obj)
+
+
+CODECS = {'json': Codec('json', json.loads, _json_dumps)}
+if orjson:
+    CODECS['orjson'] = Codec('orjson', orjson.loads, _orjson_dumps)
+
+codec = CODECS['orjson'] if orjson else CODECS['json']
+
+
+def use(name: str) -> Codec:
+    """Switch the codec: 'json', 'orjson' or 'auto' (orjson when installed). Unknown names fall back to auto."""
+    global codec
+    codec = CODECS[name] if name in CODECS else CODECS['orjson'] if orjson else CODECS['json']
+    return codec
+
+def loads(data):
+    return codec.loads(data)
+
+def dumps(obj) -> bytes:
+    return codec.dumps(obj)
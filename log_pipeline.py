@@ -0,0 +1,183 @@
+import atexit
+import logging
+import os
+import random
+import shutil
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import Queue
+from state_file import lock_file, unlock_file
+
+formatter = logging.Formatter(fmt = '%(asctime)s %(levelname)s: %(message)s', datefmt='%d-%b-%y %H:%M:%S')
+
+_queue = Queue()
+_handlers = {}
+_listener = None
+_payload = {} #метод -> {'max_chars': ..., 'sample': ...}, '*' - для всех остальных
+
+
+class SharedRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler for a log appended to by several processes.
+
+    Rotation runs under a lock file, and a process whose file was rotated by another one
+    reopens the new file instead of writing on into the renamed backup. Windows can't rename
+    a file another process holds open; there the log is copied to the backup and truncated
+    in place, and a record another process writes during the copy can be lost.
+    """
+
+    def _rotated_elsewhere(self) -> bool:
+        try:
+            return os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except OSError:
+            return True
+
+    def _reopen(self):
+        self.stream.close()
+        self.stream = self._open()
+
+    def emit(self, record):
+        try:
+            #сообщение собирается один раз: его используют и shouldRollover, и сама запись
+            record.msg, record.args = record.getMessage(), None
+            if self.stream is not None and self._rotated_elsewhere():
+                self._reopen()
+        except Exception:
+            self.handleError(record)
+            return
+        super().emit(record)
+
+    def rotate(self, source, dest):
+        try:
+            super().rotate(source, dest)
+        except PermissionError:
+            shutil.copyfile(source, dest)
+            with open(source, 'r+b') as log_file:
+                log_file.truncate()
+
+    def doRollover(self):
+        with open(self.baseFilename + '.lock', 'a') as lock:
+            lock_file(lock)
+            try:
+                if self.stream is not None and self._rotated_elsewhere():
+                    self._reopen()
+                    return
+                super().doRollover()
+            finally:
+                unlock_file(lock)
+
+
+class _TruncatedPayload(Exception):
+    pass
+
+
+def _bounded_str(obj, limit: int) -> str:
+    """str(obj) for JSON-like data, giving up once the text passes limit characters.
+
+    Unlike str(obj)[:limit] the cost does not grow with the size of the response.
+    """
+    parts = []
+    size = [0]
+
+    def put(text):
+        parts.append(text)
+        size[0] += len(text)
+        if size[0] > limit:
+            raise _TruncatedPayload()
+
+    def walk(value, top=True):
+        if isinstance(value, dict):
+            put('{')
+            #копия пар: объект может меняться в потоке запроса, пока тело пишется в лог
+            for i, (key, item) in enumerate(list(value.items())):
+                put(', ' if i else '')
+                put(repr(key))
+                put(': ')
+                walk(item, False)
+            put('}')
+        elif isinstance(value, (list, tuple)):
+            put('[' if isinstance(value, list) else '(')
+            for i, item in enumerate(value):
+                put(', ' if i else '')
+                walk(item, False)
+            put(']' if isinstance(value, list) else ')')
+        else:
+            put(str(value) if top else repr(value))
+
+    try:
+        walk(obj)
+    except _TruncatedPayload:
+        return ''.join(parts)[:limit] + '... [truncated]'
+    return ''.join(parts)
+
+
+class Payload:
+    """Log argument for request and response bodies, formatted only if the record is emitted.
+
+    The method's payload settings decide whether the body is written at all (sample)
+    and how much of it (max_chars). Formatting happens on the listener thread, so the
+    body is written as it is at that moment.
+    """
+    __slots__ = ('obj', 'method')
+
+    def __init__(self, obj, method=None):
+        self.obj = obj
+        self.method = method.value if hasattr(method, 'value') else method
+
+    def __str__(self):
+        policy = _payload[self.method] if self.method in _payload else _payload['*'] if '*' in _payload else {}
+        if 'sample' in policy and random.random() >= float(policy['sample']):
+            return '[skipped]'
+        limit = int(policy['max_chars']) if 'max_chars' in policy else 0
+        if not limit:
+            return str(self.obj)
+        return _bounded_str(self.obj, limit)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stdlib prepare() formats the message on the calling thread, which would build
+    every Payload body there.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logger(name, log_file, level=logging.INFO):
+    """Logger whose records go through a queue to a rotating file written by a background thread."""
+    global _listener
+    handler = SharedRotatingFileHandler(log_file, maxBytes=10 * 1024 * 1024, backupCount=5)
+    handler.setFormatter(formatter)
+    handler.addFilter(logging.Filter(name))
+    _handlers[name] = handler
+
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.addHandler(_DeferredQueueHandler(_queue))
+
+    if _listener:
+        _listener.stop()
+    _listener = QueueListener(_queue, *_handlers.values(), respect_handler_level=True)
+    _listener.start()
+
+    return logger
+
+
+def configure_logging(options: dict):
+    """Apply the 'logging' section of a config: level, max_bytes, backup_count and payload."""
+    global _payload
+    options = options or {}
+    logging.getLogger('info_log').setLevel(str(options['level']).upper() if 'level' in options else logging.INFO)
+    for handler in _handlers.values():
+        if 'max_bytes' in options:
+            handler.maxBytes = int(options['max_bytes'])
+        if 'backup_count' in options:
+            handler.backupCount = int(options['backup_count'])
+    _payload = dict(options['payload']) if 'payload' in options and options['payload'] else {}
+
+
+def _stop():
+    if _listener:
+        _listener.stop()
+
+atexit.register(_stop)
@@ -0,0 +1,26 @@
+import json
+import os
+from state_file import lock_file, unlock_file
+
+
+class Manifest:
+    """Append-only JSON Lines index of finished output files.
+
+    One line per file (file, method, campaign, orders, size, sha256, time), written after
+    the file is in place, so a reader tailing the manifest never sees a half-written file.
+    Appends from concurrent processes are serialised with a file lock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def record(self, entry: dict):
+        line = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+        with open(self.path, 'ab') as manifest_file:
+            lock_file(manifest_file)
+            try:
+                manifest_file.write(line)
+                manifest_file.flush()
+                os.fsync(manifest_file.fileno())
+            finally:
+                unlock_file(manifest_file)
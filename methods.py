@@ -12,7 +12,9 @@ class Method(Enum):
     FBY_GET_ORDERS = 'fby_get_orders'
     FBS_SET_STATUS = 'fbs_set_status'
     FBS_SET_BOXES = 'fbs_set_boxes'
+    FBS_SET_BOXES_BULK = 'fbs_set_boxes_bulk'
     GET_ORDER_INFO = 'get_order_info'
+    GET_ORDERS_INFO = 'get_orders_info'
     GET_BUYER_INFO = 'get_buyer_info'
     SET_PRICES = 'set_prices'
     DBS_GET_ORDERS_FOR_CANCELLATION_APPROVE = 'dbs_get_orders_for_cancellation_approve'
@@ -20,9 +22,11 @@ class Method(Enum):
     DBS_SET_TRACK = 'dbs_set_track'
     DBS_SET_STATUS = 'dbs_set_status'
     DBS_CHANGE_DATE = 'dbs_change_date'
+    ORDERS_SET_STATUS = 'orders_set_status'
     YD_CREATE_OFFER = 'yd_create_offer'
     YD_CANCEL_OFFER = 'yd_cancel_offer'
     YD_OFFER_INFO = 'yd_offer_info'
+    YD_POLL_OFFERS = 'yd_poll_offers'
 
 class Status(Enum):
     SET_READY = 'SET_READY'
@@ -0,0 +1,172 @@
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from state_file import load_state, save_state, lock_file, unlock_file
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+DESCRIPTIONS = {
+    'yandex_method_calls_total': ('counter', 'Executed requests by method and result'),
+    'yandex_method_duration_seconds': ('histogram', 'Wall time of one request of the config, including output'),
+    'yandex_output_bytes_total': ('counter', 'Bytes of XML written by method'),
+    'yandex_xml_duration_seconds': ('histogram', 'Time spent converting JSON to XML'),
+    'yandex_http_request_duration_seconds': ('histogram', 'Time of one HTTP attempt by endpoint'),
+    'yandex_http_responses_total': ('counter', 'HTTP responses by endpoint and status'),
+    'yandex_http_retries_total': ('counter', 'Repeated HTTP attempts by endpoint and reason'),
+    'yandex_http_sent_bytes_total': ('counter', 'Request body bytes by endpoint'),
+    'yandex_http_received_bytes_total': ('counter', 'Response body bytes by endpoint'),
+    'yandex_json_decode_duration_seconds': ('histogram', 'Time spent decoding response JSON by endpoint'),
+}
+
+_ID = re.compile(r'/\d+(?=/|\.|$)')
+
+
+def endpoint(url: str) -> str:
+    """URL path with numeric ids folded, so every order or campaign shares one label."""
+    return _ID.sub('/{id}', urlsplit(url).path)
+
+
+def _labels(labels: dict) -> str:
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                    for name, value in sorted(labels.items()))
+
+
+class Metrics:
+    """Counters and histograms kept in memory until export() adds them to the metrics file.
+
+    Disabled until configure() gets a file, so the hot path costs a single attribute check.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.file = ''
+        self.format = 'prometheus'
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = {}
+        self._histograms = {}
+
+    def configure(self, options: dict):
+        if not options or 'file' not in options:
+            self.enabled = False
+            return
+        self.file = options['file']
+        self.format = options['format'] if 'format' in options else 'prometheus'
+        self.enabled = True
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        if not self.enabled:
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0}
+            histogram = self._histograms[key]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+                    break
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @property
+    def method(self) -> str:
+        """Method executed by the current thread, set by _execute_method."""
+        return getattr(self._local, 'method', '')
+
+    @method.setter
+    def method(self, value: str):
+        self._local.method = value
+
+    def _drain(self):
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            histograms, self._histograms = self._histograms, {}
+        return counters, histograms
+
+    def export(self):
+        """Add the collected values to the metrics file and start over.
+
+        Several processes may run at once, so the running totals live in a JSON file
+        updated under a lock; for the prometheus format the .prom file is rendered from it.
+        """
+        if not self.enabled:
+            return
+        counters, histograms = self._drain()
+        state_path = self.file if self.format == 'json' else self.file + '.json'
+        with open(state_path + '.lock', 'a+') as lock:
+            lock_file(lock)
+            try:
+                state = load_state(state_path) if os.path.exists(state_path) and os.path.getsize(state_path) else {}
+                _merge(state, counters, histograms)
+                save_state(state_path, state)
+                if self.format != 'json':
+                    temp_path = os.path.join(os.path.dirname(self.file), '.%s.tmp' % os.path.basename(self.file))
+                    with open(temp_path, 'w', encoding='utf-8') as prom_file:
+                        prom_file.write(render_prometheus(state))
+                    os.replace(temp_path, self.file)
+            finally:
+                unlock_file(lock)
+
+
+def _merge(state: dict, counters: dict, histograms: dict):
+    state_counters = state.setdefault('counters', {})
+    for (name, labels), value in counters.items():
+        values = state_counters.setdefault(name, {})
+        values[labels] = values.get(labels, 0) + value
+    state_histograms = state.setdefault('histograms', {})
+    for (name, labels), histogram in histograms.items():
+        values = state_histograms.setdefault(name, {})
+        if labels not in values:
+            values[labels] = {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0}
+        total = values[labels]
+        total['buckets'] = [a + b for a, b in zip(total['buckets'], histogram['buckets'])]
+        total['sum'] += histogram['sum']
+        total['count'] += histogram['count']
+    state['updated'] = time.time()
+
+
+def render_prometheus(state: dict) -> str:
+    lines = []
+    for kind, section in (('counter', 'counters'), ('histogram', 'histograms')):
+        for name, values in sorted(state.get(section, {}).items()):
+            if name in DESCRIPTIONS:
+                lines.append('# HELP %s %s' % (name, DESCRIPTIONS[name][1]))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in sorted(values.items()):
+                if kind == 'counter':
+                    lines.append('%s{%s} %s' % (name, labels, value))
+                    continue
+                prefix = labels + ',' if labels else ''
+                cumulative = 0
+                for bound, count in zip(BUCKETS, value['buckets']):
+                    cumulative += count
+                    lines.append('%s_bucket{%sle="%s"} %s' % (name, prefix, bound, cumulative))
+                lines.append('%s_bucket{%sle="+Inf"} %s' % (name, prefix, value['count']))
+                lines.append('%s_sum{%s} %s' % (name, labels, value['sum']))
+                lines.append('%s_count{%s} %s' % (name, labels, value['count']))
+    return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
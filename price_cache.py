@@ -0,0 +1,45 @@
+import hashlib
+import json
+import sqlite3
+from time import time
+
+OFFER_KEYS = ('id', 'offerId', 'shopSku', 'marketSku')
+
+
+def offer_key(offer: dict) -> str:
+    for key in OFFER_KEYS:
+        if key in offer:
+            return str(offer[key])
+    return ''
+
+
+def offer_digest(offer: dict) -> str:
+    return hashlib.blake2b(json.dumps(offer, sort_keys=True, ensure_ascii=False).encode('utf-8'), digest_size=12).hexdigest()
+
+
+class PriceCache:
+    """Last successfully pushed price of every offer, per campaign, in a SQLite file."""
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS prices (campaign_id TEXT, offer_id TEXT, digest TEXT, updated REAL, PRIMARY KEY (campaign_id, offer_id))')
+        self._db.commit()
+
+    def changed(self, campaign_id: str, offers):
+        """Yield only the offers whose price differs from the stored one."""
+        for offer in offers:
+            key = offer_key(offer)
+            if key:
+                row = self._db.execute('SELECT digest FROM prices WHERE campaign_id = ? AND offer_id = ?', (str(campaign_id), key)).fetchone()
+                if row and row[0] == offer_digest(offer):
+                    continue
+            yield offer
+
+    def store(self, campaign_id: str, offers: list):
+        now = time()
+        self._db.executemany('INSERT OR REPLACE INTO prices (campaign_id, offer_id, digest, updated) VALUES (?, ?, ?, ?)',
+                             [(str(campaign_id), offer_key(offer), offer_digest(offer), now) for offer in offers if offer_key(offer)])
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,64 @@
+import json_codec
+import sqlite3
+import threading
+from time import time
+
+DEFAULT_TTL = 60
+
+
+class ResponseCache:
+    """Read-through cache of API responses keyed by (method, campaign_id, object id), kept in a SQLite file.
+
+    Entries expire after the method's TTL in seconds (0 disables caching for it); the least recently
+    used ones are evicted once max_entries is exceeded.
+    """
+
+    def __init__(self, path: str, max_entries: int = 1000, ttl: dict = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = dict(ttl or {})
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS responses (method TEXT, campaign_id TEXT, object_id TEXT, response TEXT, stored REAL, used REAL, PRIMARY KEY (method, campaign_id, object_id))')
+        self._db.commit()
+
+    def _ttl(self, method: str) -> float:
+        return float(self.ttl[method]) if method in self.ttl else DEFAULT_TTL
+
+    def get(self, method: str, campaign_id, object_id):
+        ttl = self._ttl(method)
+        if ttl <= 0:
+            return None
+        key = (method, str(campaign_id), str(object_id))
+        now = time()
+        with self._lock:
+            row = self._db.execute('SELECT response, stored FROM responses WHERE method = ? AND campaign_id = ? AND object_id = ?', key).fetchone()
+            if not row:
+                return None
+            if row[1] + ttl < now:
+                self._db.execute('DELETE FROM responses WHERE method = ? AND campaign_id = ? AND object_id = ?', key)
+                self._db.commit()
+                return None
+            self._db.execute('UPDATE responses SET used = ? WHERE method = ? AND campaign_id = ? AND object_id = ?', (now,) + key)
+            self._db.commit()
+        return json_codec.loads(row[0])
+
+    def put(self, method: str, campaign_id, object_id, response: dict):
+        if self._ttl(method) <= 0:
+            return
+        now = time()
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO responses (method, campaign_id, object_id, response, stored, used) VALUES (?, ?, ?, ?, ?, ?)',
+                             (method, str(campaign_id), str(object_id), json_codec.dumps(response), now, now))
+            self._db.execute('DELETE FROM responses WHERE rowid IN (SELECT rowid FROM responses ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+            self._db.commit()
+
+    def invalidate(self, campaign_id, object_id, methods: tuple):
+        with self._lock:
+            self._db.executemany('DELETE FROM responses WHERE method = ? AND campaign_id = ? AND object_id = ?',
+                                 [(method, str(campaign_id), str(object_id)) for method in methods])
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,68 @@
+import json
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+def load_state(path: str) -> dict:
+    """Small JSON state kept between runs, empty when the file does not exist yet."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as state_file:
+        return json.load(state_file)
+
+
+def save_state(path: str, state: dict):
+    """Replace the state file atomically, so a crash leaves either the old or the new state.
+
+    The temp file gets a unique name, so concurrent writers never clobber each other's temp file.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(prefix='.%s.' % name, suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(handle, 'w', encoding='utf-8') as state_file:
+            json.dump(state, state_file)
+            state_file.flush()
+            os.fsync(state_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def update_state(path: str, key: str, value):
+    """Set state[key] = value with a read-modify-write under a lock file.
+
+    Campaigns sharing one state file each update only their own key, so concurrent
+    threads and processes don't overwrite each other's entries.
+    """
+    with open(path + '.lock', 'a') as lock:
+        lock_file(lock)
+        try:
+            state = load_state(path)
+            state[key] = value
+            save_state(path, state)
+        finally:
+            unlock_file(lock)
+
+
+def lock_file(opened_file):
+    """Exclusive lock shared between processes, released by unlock_file()."""
+    if fcntl:
+        fcntl.flock(opened_file.fileno(), fcntl.LOCK_EX)
+    else:
+        opened_file.seek(0)
+        msvcrt.locking(opened_file.fileno(), msvcrt.LK_LOCK, 1)
+
+def unlock_file(opened_file):
+    if fcntl:
+        fcntl.flock(opened_file.fileno(), fcntl.LOCK_UN)
+    else:
+        opened_file.seek(0)
+        msvcrt.locking(opened_file.fileno(), msvcrt.LK_UNLCK, 1)
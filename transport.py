@@ -0,0 +1,261 @@
+import json
+import logging
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import NamedTuple
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from state_file import lock_file, unlock_file
+from metrics import metrics, endpoint
+
+THROTTLE_STATUSES = (420, 429)
+RETRY_STATUSES = (500, 502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+
+log_info = logging.getLogger('info_log')
+
+
+class TransportSettings(NamedTuple):
+    pool_size: int = 10
+    connect_timeout: float = 10.0
+    read_timeout: float = 120.0
+    max_per_host: int = 10
+    rate: float = 0.0 #запросов в секунду на хост и кампанию, 0 - без ограничения
+    burst: int = 10
+    throttle_retries: int = 5
+    retries: int = 3
+    backoff_base: float = 1.0
+    backoff_max: float = 120.0
+    state_file: str = ''
+
+
+class Throttle:
+    """Token bucket per (host, campaign) plus a 'blocked until' mark after 420/429.
+
+    With state_file the buckets live in a small JSON file guarded by a file lock,
+    so separate processes share one budget instead of stampeding the API together.
+    """
+
+    def __init__(self, rate: float, burst: int, state_file: str = ''):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.state_file = state_file
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def _update(self, key: str, change):
+        with self._lock:
+            if not self.state_file:
+                entry = self._state.setdefault(key, {})
+                return change(entry)
+            with open(self.state_file, 'a+') as state_file:
+                lock_file(state_file)
+                try:
+                    state_file.seek(0)
+                    try:
+                        state = json.loads(state_file.read() or '{}')
+                    except ValueError:
+                        state = {}
+                    entry = state.setdefault(key, {})
+                    before = dict(entry)
+                    result = change(entry)
+                    if entry != before: #без изменений файл не переписывается
+                        state_file.seek(0)
+                        state_file.truncate()
+                        state_file.write(json.dumps(state))
+                        state_file.flush()
+                    return result
+                finally:
+                    unlock_file(state_file)
+
+    def _blocked(self, key: str) -> float:
+        """Seconds left of a 420/429 block recorded in state_file, read without locking or rewriting the file."""
+        try:
+            with open(self.state_file, 'r') as state_file:
+                state = json.loads(state_file.read() or '{}')
+        except (OSError, ValueError):
+            return 0
+        return max(state.get(key, {}).get('blocked_until', 0) - time.time(), 0)
+
+    def _take(self, entry: dict) -> float:
+        now = time.time()
+        blocked_until = entry.get('blocked_until', 0)
+        if blocked_until > now:
+            return blocked_until - now
+        if not self.rate:
+            return 0
+        tokens = min(self.burst, entry.get('tokens', self.burst) + (now - entry.get('updated', now)) * self.rate)
+        entry['updated'] = now
+        if tokens >= 1:
+            entry['tokens'] = tokens - 1
+            return 0
+        entry['tokens'] = tokens
+        return (1 - tokens) / self.rate
+
+    def acquire(self, key: str):
+        while True:
+            #без rate корзина не нужна: общий файл только читается ради отметки blocked_until
+            wait = self._blocked(key) if self.state_file and not self.rate else self._update(key, self._take)
+            if wait <= 0:
+                return
+            time.sleep(min(wait, 60))
+
+    def block(self, key: str, seconds: float):
+        def change(entry):
+            entry['blocked_until'] = max(entry.get('blocked_until', 0), time.time() + seconds)
+        self._update(key, change)
+
+
+def retry_after(response) -> float:
+    """Seconds from a Retry-After header (delta or HTTP date), None when absent or unreadable."""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt: int, base: float, cap: float, hint: float = None) -> float:
+    """Jittered exponential delay; a server hint (Retry-After) is a lower bound."""
+    if hint is not None:
+        return hint + random.uniform(0, base)
+    delay = min(cap, base * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class Transport:
+    """Keep-alive session per host, shared by post_query / put_query / get_query."""
+
+    def __init__(self, settings: TransportSettings = TransportSettings()):
+        self.settings = settings
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._limits = {}
+        self._throttle = Throttle(settings.rate, settings.burst, settings.state_file)
+
+    def configure(self, settings: TransportSettings):
+        with self._lock:
+            if settings == self.settings:
+                return
+            self.settings = settings
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+            self._limits = {}
+            self._throttle = Throttle(settings.rate, settings.burst, settings.state_file)
+
+    def _host(self, url: str) -> str:
+        parts = urlsplit(url)
+        return '%s://%s' % (parts.scheme, parts.netloc)
+
+    def _throttle_key(self, host: str, url: str) -> str:
+        campaign = re.search(r'/campaigns/(\d+)', url)
+        return '%s|%s' % (host, campaign.group(1) if campaign else '')
+
+    def _session(self, host: str):
+        with self._lock:
+            if host not in self._sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.settings.pool_size)
+                session.mount(host, adapter)
+                self._sessions[host] = session
+                self._limits[host] = threading.BoundedSemaphore(self.settings.max_per_host)
+            return self._sessions[host], self._limits[host]
+
+    def request(self, method: str, url: str, idempotent: bool = None, **kwargs):
+        """Send a request, retrying throttled ones and, within settings.retries, failed ones.
+
+        Idempotent requests (GET/PUT by default) are retried on connection errors, timeouts
+        and 5xx gateway statuses. Others only when the connection itself failed.
+        """
+        host = self._host(url)
+        session, limit = self._session(host)
+        throttle, settings = self._throttle, self.settings
+        key = self._throttle_key(host, url)
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        retryable = (requests.exceptions.ConnectionError, requests.exceptions.Timeout) if idempotent else requests.exceptions.ConnectionError
+        kwargs.setdefault('timeout', (settings.connect_timeout, settings.read_timeout))
+        throttled = 0
+        retried = 0
+        label = endpoint(url) if metrics.enabled else ''
+        if label and 'data' in kwargs and kwargs['data']:
+            metrics.inc('yandex_http_sent_bytes_total', len(kwargs['data']), endpoint=label)
+        while True:
+            throttle.acquire(key)
+            try:
+                with limit, metrics.timer('yandex_http_request_duration_seconds', endpoint=label):
+                    response = session.request(method, url, **kwargs)
+            except retryable as ex:
+                metrics.inc('yandex_http_responses_total', endpoint=label, status=type(ex).__name__)
+                if retried >= settings.retries:
+                    raise
+                metrics.inc('yandex_http_retries_total', endpoint=label, reason='error')
+                delay = backoff_delay(retried, settings.backoff_base, settings.backoff_max)
+                log_info.info('%s %s failed: %s, retry %s in %.1f s', method, url, ex, retried + 1, delay)
+                retried += 1
+                time.sleep(delay)
+                continue
+            if label:
+                metrics.inc('yandex_http_responses_total', endpoint=label, status=response.status_code)
+                metrics.inc('yandex_http_received_bytes_total', len(response.content), endpoint=label)
+            if response.status_code in THROTTLE_STATUSES and throttled < settings.throttle_retries:
+                metrics.inc('yandex_http_retries_total', endpoint=label, reason='throttled')
+                delay = backoff_delay(throttled, settings.backoff_base, settings.backoff_max, retry_after(response))
+                log_info.info('Throttled with status %s on %s, retry in %.1f s', response.status_code, url, delay)
+                throttle.block(key, delay)
+                throttled += 1
+                continue
+            if idempotent and response.status_code in RETRY_STATUSES and retried < settings.retries:
+                metrics.inc('yandex_http_retries_total', endpoint=label, reason='status')
+                delay = backoff_delay(retried, settings.backoff_base, settings.backoff_max, retry_after(response))
+                log_info.info('%s %s returned %s, retry %s in %.1f s', method, url, response.status_code, retried + 1, delay)
+                retried += 1
+                time.sleep(delay)
+                continue
+            return response
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+            self._limits = {}
+
+
+def settings_from_config(config: dict) -> TransportSettings:
+    options = config['transport'] if 'transport' in config and config['transport'] else {}
+    defaults = TransportSettings()
+    return TransportSettings(**{field: type(getattr(defaults, field))(options[field]) if field in options else getattr(defaults, field)
+                                for field in TransportSettings._fields})
+
+
+class RateLimiter:
+    """Spaces calls to wait() at least 1/rate seconds apart across threads. rate 0 disables it."""
+
+    def __init__(self, rate: float = 0):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+transport = Transport()
@@ -0,0 +1,203 @@
+from typing import Callable, NamedTuple
+from datetime import datetime
+
+
+class Fields(NamedTuple):
+    """Scalar children written as <name>value</name> when the key is present (or truthy)."""
+    names: tuple
+    truthy: bool = False
+    raw: bool = False
+
+
+class Value(NamedTuple):
+    """Single scalar child that must be present."""
+    key: str
+    tag: str = None
+    raw: bool = False
+
+
+class Params(NamedTuple):
+    """'_param' passthrough keys, written as <prefix_param>. indent overrides the nesting depth."""
+    prefix: str = ''
+    indent: int = None
+
+
+class AllFields(NamedTuple):
+    """Every key of the object, in dict order."""
+    pass
+
+
+class Now(NamedTuple):
+    """Current local time."""
+    tag: str
+    fmt: str = "%d-%m-%Y %H:%M:%S"
+
+
+class Section(NamedTuple):
+    """<key> wrapping the nested object obj[key]."""
+    key: str
+    items: tuple
+    optional: bool = False
+
+
+class Each(NamedTuple):
+    """<key> wrapping a <tag> element per entry of the list obj[key]."""
+    key: str
+    tag: str
+    items: tuple
+    optional: bool = False
+
+
+class EachValue(NamedTuple):
+    """<wrapper> holding a <tag>value</tag> per entry of the list obj[key]."""
+    key: str
+    wrapper: str
+    tag: str
+
+
+class Switch(NamedTuple):
+    """Emit present when key is in the object, otherwise absent."""
+    key: str
+    present: tuple
+    absent: tuple
+
+
+class Element(NamedTuple):
+    """Root element: one <tag> around the object, or around every entry when the object is a list."""
+    tag: str
+    items: tuple
+    indent: int = 0
+    many: bool = False
+
+
+def _pad(depth: int) -> str:
+    return ' ' * depth
+
+def _compile_items(items: tuple, depth: int, value_filter: Callable) -> Callable:
+    emitters = [_compile(item, depth, value_filter) for item in items]
+    if len(emitters) == 1:
+        return emitters[0]
+
+    def emit(obj, append):
+        for emitter in emitters:
+            emitter(obj, append)
+    return emit
+
+def _compile(node, depth: int, value_filter: Callable) -> Callable:
+    pad = _pad(depth)
+
+    if isinstance(node, Fields):
+        fields = tuple((name, '%s<%s>' % (pad, name), '</%s>' % name) for name in node.names)
+        convert = str if node.raw else value_filter
+        if node.truthy:
+            def emit(obj, append):
+                for name, head, tail in fields:
+                    if name in obj and obj[name]:
+                        append(head + convert(obj[name]) + tail)
+        else:
+            def emit(obj, append):
+                for name, head, tail in fields:
+                    if name in obj:
+                        append(head + convert(obj[name]) + tail)
+        return emit
+
+    if isinstance(node, Value):
+        tag = node.tag or node.key
+        key, head, tail = node.key, '%s<%s>' % (pad, tag), '</%s>' % tag
+        convert = str if node.raw else value_filter
+        def emit(obj, append):
+            append(head + convert(obj[key]) + tail)
+        return emit
+
+    if isinstance(node, Params):
+        head = '%s<%s' % (_pad(depth if node.indent is None else node.indent), node.prefix)
+        tail = '</%s' % node.prefix
+        def emit(obj, append):
+            for name in obj.keys():
+                if name.startswith('_'):
+                    append('%s%s>%s%s%s>' % (head, name, value_filter(obj[name]), tail, name))
+        return emit
+
+    if isinstance(node, AllFields):
+        def emit(obj, append):
+            for name in obj:
+                append('%s<%s>%s</%s>' % (pad, name, value_filter(obj[name]), name))
+        return emit
+
+    if isinstance(node, Now):
+        head, tail, fmt = '%s<%s>' % (pad, node.tag), '</%s>' % node.tag, node.fmt
+        def emit(obj, append):
+            append(head + datetime.strftime(datetime.now(), fmt) + tail)
+        return emit
+
+    if isinstance(node, Section):
+        key, open_tag, close_tag = node.key, '%s<%s>' % (pad, node.key), '%s</%s>' % (pad, node.key)
+        inner = _compile_items(node.items, depth + 1, value_filter)
+        optional = node.optional
+        def emit(obj, append):
+            if optional and key not in obj:
+                return
+            append(open_tag)
+            inner(obj[key], append)
+            append(close_tag)
+        return emit
+
+    if isinstance(node, Each):
+        key, open_tag, close_tag = node.key, '%s<%s>' % (pad, node.key), '%s</%s>' % (pad, node.key)
+        item_open, item_close = '%s<%s>' % (_pad(depth + 1), node.tag), '%s</%s>' % (_pad(depth + 1), node.tag)
+        inner = _compile_items(node.items, depth + 2, value_filter)
+        optional = node.optional
+        def emit(obj, append):
+            if optional and key not in obj:
+                return
+            append(open_tag)
+            for element in obj[key]:
+                append(item_open)
+                inner(element, append)
+                append(item_close)
+            append(close_tag)
+        return emit
+
+    if isinstance(node, EachValue):
+        key, open_tag, close_tag = node.key, '%s<%s>' % (pad, node.wrapper), '%s</%s>' % (pad, node.wrapper)
+        head, tail = '%s<%s>' % (_pad(depth + 1), node.tag), '</%s>' % node.tag
+        def emit(obj, append):
+            append(open_tag)
+            for element in obj[key]:
+                append(head + value_filter(element) + tail)
+            append(close_tag)
+        return emit
+
+    if isinstance(node, Switch):
+        key = node.key
+        present = _compile_items(node.present, depth, value_filter)
+        absent = _compile_items(node.absent, depth, value_filter)
+        def emit(obj, append):
+            if key in obj:
+                present(obj, append)
+            else:
+                absent(obj, append)
+        return emit
+
+    if isinstance(node, Element):
+        open_tag, close_tag = '%s<%s>' % (_pad(node.indent), node.tag), '%s</%s>' % (_pad(node.indent), node.tag)
+        inner = _compile_items(node.items, node.indent + 1, value_filter)
+        if node.many:
+            def emit(obj, append):
+                for element in obj:
+                    append(open_tag)
+                    inner(element, append)
+                    append(close_tag)
+        else:
+            def emit(obj, append):
+                append(open_tag)
+                inner(obj, append)
+                append(close_tag)
+        return emit
+
+    raise TypeError('Unknown schema node %r' % (node,))
+
+
+def compile_schema(schema: Element, value_filter: Callable) -> Callable:
+    """Turn a schema into an emitter called as emitter(json_data, xml_data.append)."""
+    return _compile(schema, 0, value_filter)
@@ -0,0 +1,100 @@
+import hashlib
+import logging
+import os
+from datetime import datetime
+
+log_error = logging.getLogger('error_log')
+
+
+class XmlSink:
+    """List-like target for handlers that streams every appended line to a temp file.
+
+    Lines are encoded as soon as they arrive, so peak memory stays bounded by what a
+    handler holds itself (one page for paginated methods). commit() renames the temp
+    file to out_file atomically, discard() removes it.
+    """
+
+    def __init__(self, out_file: str, encoding: str = 'cp1251', name_factory=None, meta: dict = None, manifest=None, params: dict = None):
+        self.encoding = encoding
+        self.committed = []
+        self.entries = []
+        self.size = 0 #байты в уже переименованных файлах
+        self.meta = meta or {}
+        self.manifest = manifest
+        self.params = params #добавляются к каждому записываемому объекту как '_param'
+        self._name_factory = name_factory
+        self._on_commit = []
+        self._open(out_file)
+
+    def _open(self, out_file: str):
+        self.out_file = out_file
+        self.temp_file = os.path.join(os.path.dirname(out_file), '.%s.tmp' % os.path.basename(out_file))
+        self.lines = 0
+        self.ids = []
+        self._ids = set()
+        self._file_size = 0
+        self._digest = hashlib.sha256()
+        self._file = open(self.temp_file, 'xb')
+
+    def append(self, line: str):
+        data = line.encode(self.encoding, errors='ignore')
+        if self.lines:
+            data = b'\n' + data
+        self._file.write(data)
+        self._digest.update(data)
+        self._file_size += len(data)
+        self.lines += 1
+
+    def extend(self, lines):
+        for line in lines:
+            self.append(line)
+
+    def __len__(self):
+        return self.lines
+
+    def add_ids(self, ids):
+        """Order ids written to the current file, listed in its manifest entry."""
+        for object_id in ids:
+            if object_id not in self._ids:
+                self._ids.add(object_id)
+                self.ids.append(object_id)
+
+    def on_commit(self, callback):
+        """Run callback once the output file is in place, e.g. to advance a checkpoint."""
+        self._on_commit.append(callback)
+
+    def commit(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.temp_file, self.out_file)
+        self.committed.append(self.out_file)
+        self.size += self._file_size
+        entry = dict(self.meta, file=os.path.basename(self.out_file), orders=self.ids, size=self._file_size,
+                     sha256=self._digest.hexdigest(), time=datetime.now().isoformat(timespec='seconds'))
+        self.entries.append(entry)
+        #файл уже на месте: ошибки манифеста и колбэков только логируются, запись не считается неудачной
+        if self.manifest:
+            try:
+                self.manifest(entry)
+            except Exception as e:
+                log_error.error('Manifest error for %s: %s', self.out_file, str(e))
+        callbacks, self._on_commit = self._on_commit, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                log_error.error('After write error for %s: %s', self.out_file, str(e))
+
+    def rotate(self) -> str:
+        """Finish the current document as its own file and continue writing into a new one."""
+        out_file = self.out_file
+        self.commit()
+        self._open(self._name_factory())
+        return out_file
+
+    def discard(self):
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.temp_file):
+            os.remove(self.temp_file)
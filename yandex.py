@@ -1,36 +1,54 @@
-import logging
 import ssl
 import sys
 import os
-from typing import Callable, Iterable, Sequence
-import requests
+from typing import Callable
 import json
 import random
 import string
+import csv
+from collections import deque
+import threading
+import hashlib
+import itertools
+import asyncio
+from queue import Queue, Full
 from methods import Method, QueryResponse, Status
+from transport import transport, settings_from_config, RateLimiter
+from price_cache import PriceCache
+from response_cache import ResponseCache
+from state_file import load_state, update_state
+from xml_sink import XmlSink
+from manifest import Manifest
+from metrics import metrics, endpoint
+import json_codec
+from log_pipeline import setup_logger, configure_logging, Payload
+from xml_schema import compile_schema, AllFields, Each, EachValue, Element, Fields, Now, Params, Section, Switch, Value
 from datetime import datetime
-from time import sleep
+from time import sleep, time, perf_counter
+from concurrent.futures import ThreadPoolExecutor
 
 unicode_replace = {u"\u2013": "-",u"\u2014": "-",u"\xab": '"',u"\xbb": '"',u"\xf6": 'o',u"\xca": 'e'}
+xml_escape = {'&': '&amp;', '<': '&lt;', '>': '&gt;'}
 
-def _unicode_filter(param):
-    tmp = str(param)
-    for u in unicode_replace:
-        if tmp.find(u) != -1:
-            tmp = tmp.replace(u, unicode_replace[u])
-    return tmp
-
-formatter = logging.Formatter(fmt = '%(asctime)s %(levelname)s: %(message)s', datefmt='%d-%b-%y %H:%M:%S')
+def _build_unicode_table(extra: dict = None) -> dict:
+    return str.maketrans({**unicode_replace, **(extra or {}), **xml_escape})
 
-def setup_logger(name, log_file, level=logging.INFO):
-    handler = logging.FileHandler(log_file)
-    handler.setFormatter(formatter)
+unicode_table = _build_unicode_table()
+ascii_replace = False #в таблице есть ASCII-символы из конфига: ASCII-строки тоже переводятся
 
-    logger = logging.getLogger(name)
-    logger.setLevel(level)
-    logger.addHandler(handler)
+def set_unicode_replace(extra: dict = None):
+    """Replacement table for the current config: the defaults plus its extra characters, nothing kept from earlier configs."""
+    global unicode_table, ascii_replace
+    unicode_table = _build_unicode_table(extra)
+    ascii_replace = any(str(key).isascii() for key in (extra or {}))
 
-    return logger
+def _unicode_filter(param):
+    if isinstance(param, (int, float)):
+        return str(param)
+    tmp = param if isinstance(param, str) else str(param)
+    if not ascii_replace and tmp.isascii() and '&' not in tmp and '<' not in tmp and '>' not in tmp:
+        return tmp
+    return tmp.translate(unicode_table)
 
 log_info = setup_logger('info_log','yandex.log')
 log_error = setup_logger('error_log','yandex.err')
@@ -43,9 +61,12 @@ if hasattr(ssl, '_create_unverified_context'):
 
 
 
-def post_query(url,json_body,headers) -> QueryResponse:
+def _query(method: str, url, headers, idempotent: bool = None, json_body=None) -> QueryResponse:
     try:
-        r = requests.post(url, data = json.dumps(json_body),headers = headers)
+        if json_body is None:
+            r = transport.request(method, url, idempotent = idempotent, headers = headers)
+        else:
+            r = transport.request(method, url, idempotent = idempotent, data = json_codec.dumps(json_body), headers = headers)
     except Exception as ex:
         return QueryResponse(success=False, error_message='Request error. %s' % str(ex))
 
@@ -53,52 +74,68 @@ def post_query(url,json_body,headers) -> QueryResponse:
         return QueryResponse(success=False, status=r.status_code, data=r.text)
 
     try:
-        response = json.loads(r.text)
+        with metrics.timer('yandex_json_decode_duration_seconds', endpoint=endpoint(url) if metrics.enabled else ''):
+            response = json_codec.loads(r.content) #сразу из байтов, без определения кодировки в r.text
     except Exception as ex:
         return QueryResponse(success=False, status=200, error_message='JSON error. %s' % str(ex))
 
     return QueryResponse(success=True, status=200, response=response)
 
-def put_query(url,json_body,headers) -> QueryResponse:
-    try:
-        r = requests.put(url, data = json.dumps(json_body),headers = headers)
-    except Exception as ex:
-        return QueryResponse(success=False, error_message='Request error. %s' % str(ex))
-
-    if r.status_code != 200:
-        return QueryResponse(success=False, status=r.status_code, data=r.text)
-
-    try:
-        response = json.loads(r.text)
-    except Exception as ex:
-        return QueryResponse(success=False, status=200, error_message='JSON error. %s' % str(ex))
+def post_query(url,json_body,headers,retry: bool=False) -> QueryResponse:
+    return _query('POST', url, headers, retry, json_body)
 
-    return QueryResponse(success=True, status=200, response=response)
+def put_query(url,json_body,headers,idempotent: bool=True) -> QueryResponse:
+    return _query('PUT', url, headers, idempotent, json_body)
 
 def get_query(url,headers) -> QueryResponse:
-    try:
-        r = requests.get(url, headers = headers)
-    except Exception as ex:
-        return QueryResponse(success=False, error_message='Request error. %s' % str(ex))
+    return _query('GET', url, headers)
+
+response_cache = None
+
+def _configure_response_cache(options: dict):
+    global response_cache
+    if not options or 'path' not in options:
+        if response_cache:
+            response_cache.close()
+        response_cache = None
+        return
+    max_entries = int(options['max_entries']) if 'max_entries' in options else 1000
+    ttl = options['ttl'] if 'ttl' in options else {}
+    if response_cache and response_cache.path == options['path']:
+        response_cache.max_entries = max_entries
+        response_cache.ttl = dict(ttl)
+        return
+    if response_cache:
+        response_cache.close()
+    response_cache = ResponseCache(options['path'], max_entries, ttl)
+
+def _cached_get_query(method: Method, campaign_id: str, object_id, url, headers) -> QueryResponse:
+    cache = response_cache
+    if cache:
+        response = cache.get(method.value, campaign_id, object_id)
+        if response is not None:
+            log_info.info('Cache hit %s %s', method.value, object_id)
+            return QueryResponse(success=True, status=200, response=response)
+    result = get_query(url, headers)
+    if cache and result.success:
+        cache.put(method.value, campaign_id, object_id, result.response)
+    return result
 
-    if r.status_code != 200:
-        return QueryResponse(success=False, status=r.status_code, data=r.text)
+def _invalidate_order(campaign_id: str, order_id):
+    if response_cache:
+        response_cache.invalidate(campaign_id, order_id, (Method.GET_ORDER_INFO.value, Method.GET_BUYER_INFO.value))
 
-    try:
-        response = json.loads(r.text)
-    except Exception as ex:
-        return QueryResponse(success=False, status=200, error_message='JSON error. %s' % str(ex))
-
-    return QueryResponse(success=True, status=200, response=response)
+def _log_query_error(result: QueryResponse):
+    if result.data:
+        log_error.error('Status: %s. Error: %s',result.status,result.data)
+    else:
+        log_error.error('%s%s',('Status: %s. ' % result.status) if result.status else '',result.error_message)
 
 def _post_without_xml(url:str, data: dict, headers) -> bool:
     body = data
     result = post_query(url, body, headers)
     if not result.success:
-        if result.data:
-            log_error.error('Status: %s. Error: %s',result.status,result.data)
-        else:
-            log_error.error(('%s%s'),('Status: %s. ' % result.status) if result.status else '',result.error_message)
+        _log_query_error(result)
         return False
 
     return True
@@ -107,10 +144,7 @@ def _put_without_xml(url:str, data: dict, headers) -> bool:
     body = data
     result = put_query(url, body, headers)
     if not result.success:
-        if result.data:
-            log_error.error('Status: %s. Error: %s',result.status,result.data)
-        else:
-            log_error.error(('%s%s'),('Status: %s. ' % result.status) if result.status else '',result.error_message)
+        _log_query_error(result)
         return False
 
     return True
@@ -119,228 +153,170 @@ def random_string(length: int) -> str:
     return ''.join(random.choice(string.ascii_lowercase) for _ in range(length))
 
 
-def _fill_section(xml_data: list, parent: Sequence, section: str, params: tuple, spacing: int=1):
-    if isinstance(parent, dict):
-        if section in parent:        
-            xml_data.append('%s<%s>' % (''.join([' ']*spacing), section))
-            if isinstance(parent[section], Iterable):
-                for param in params:
-                    if param in parent[section] and parent[section][param]:
-                        xml_data.append('%s<%s>%s</%s>' % (''.join([' ']*(spacing+1)), param,_unicode_filter(parent[section][param]),param))
-            xml_data.append('%s</%s>' % (''.join([' ']*spacing), section))
-    elif isinstance(parent, list):
-        for element in parent:
-            xml_data.append('%s<%s>' % (''.join([' ']*spacing), section)) 
-            for param in params:
-                if param in element and element[param]:
-                    xml_data.append('%s<%s>%s</%s>' % (''.join([' ']*(spacing+1)), param,_unicode_filter(element[param]),param))
-            xml_data.append('%s</%s>' % (''.join([' ']*spacing), section))
-    
+BOX_FIELDS = ('id','fulfilmentId','weight','width','height','depth')
+
+ORDER_SCHEMA = Element('order', indent=1, items=(
+    Params(),
+    Fields(('id','status','substatus','creationDate','currency','itemsTotal','total','deliveryTotal','subsidyTotal','paymentType','paymentMethod','fake','notes','taxSystem')),
+    Section('delivery', (
+        Fields(('id','price','deliveryPartnerType','deliveryServiceId','serviceName','type','dispatchType')),
+        Section('dates', (Fields(('fromDate','toDate','fromTime','toTime')),)),
+        Section('region', (Fields(('id','type','name')),)),
+        Section('address', (Fields(('country','postcode','city','street','house','block','recipient')),), optional=True),
+        Each('shipments', 'shipment', (
+            Fields(('id','shipmentDate','shipmentTime','status','weight','width','height','depth')),
+            Each('boxes', 'box', (Fields(BOX_FIELDS),), optional=True),
+        )),
+    )),
+    Section('buyer', (Fields(('id','lastName','firstName','middleName','type')),), optional=True),
+    Each('items', 'item', (
+        Fields(('id','offerId','count','price','vat','warehouseId','partnerWarehouseId','subsidy')),
+        Each('promos', 'promo', (Fields(('marketPromoId','subsidy','type')),), optional=True),
+        Each('subsidies', 'subsidy', (Fields(('amount','type')),), optional=True),
+    )),
+))
+
+XML_SCHEMAS = {
+    Method.FBY_GET_ORDERS: Element('fby_order', indent=1, many=True, items=(
+        Params('param'),
+        Fields(('id','creationDate','status','statusUpdateDate','paymentType'), truthy=True),
+        Each('items', 'item', (
+            Fields(('shopSku','marketSku','count'), truthy=True),
+            Each('prices', 'price', (Fields(('type','costPerItem','total'), truthy=True),)),
+        )),
+    )),
+    Method.FBS_SET_STATUS: ORDER_SCHEMA,
+    Method.FBS_SET_BOXES: Element('order', (
+        Params(),
+        Value('order', 'id'),
+        Each('boxes', 'box', (Fields(BOX_FIELDS),)),
+    )),
+    Method.FBS_SET_BOXES_BULK: Element('order', indent=1, many=True, items=(
+        Params(),
+        Value('order', 'id'),
+        Fields(('result','error')),
+        Each('boxes', 'box', (Fields(BOX_FIELDS),), optional=True),
+    )),
+    Method.GET_ORDER_INFO: ORDER_SCHEMA,
+    Method.GET_BUYER_INFO: Element('buyer-info', (
+        Params(),
+        Value('order'),
+        Fields(('id','lastName','firstName','middleName','phone')),
+    )),
+    Method.SET_PRICES: Element('set-prices', (
+        Params(indent=0),
+        Value('status', raw=True),
+        Each('errors', 'error', (Fields(('code','message')),), optional=True),
+    )),
+    Method.DBS_GET_ORDERS_FOR_CANCELLATION_APPROVE: Element('dbs_order', indent=1, many=True, items=(
+        Params('param'),
+        Fields(('id','status','substatus'), truthy=True),
+    )),
+    Method.DBS_CHANGE_DATE: Element('dbs_change_date', (AllFields(),), indent=1),
+    Method.DBS_SET_STATUS: ORDER_SCHEMA,
+    Method.ORDERS_SET_STATUS: Element('order_status', indent=1, many=True, items=(
+        Params(),
+        Value('order', 'id'),
+        Fields(('status','substatus','result','error'), truthy=True),
+    )),
+    Method.YD_CREATE_OFFER: Element('yd-create-offer', (
+        Params(indent=0),
+        Switch('error_details',
+            (EachValue('error_details', 'errors', 'error'),),
+            (Fields(('operator_request_id','pickup_interval_min','pickup_interval_max','request_id')),)),
+    )),
+    Method.YD_CANCEL_OFFER: Element('yd-cancel-offer', (
+        Params(),
+        Value('request_id'),
+        Now('timestamp'),
+    )),
+    Method.YD_OFFER_INFO: Element('yd-offer-info', (
+        Params(),
+        Value('request_id'),
+        Fields(('timestamp','status','sharing_url','total_without_vat')),
+    )),
+    Method.YD_POLL_OFFERS: Element('yd-offer-info', indent=1, many=True, items=(
+        Params(),
+        Value('request_id'),
+        Fields(('timestamp','status','sharing_url','total_without_vat')),
+    )),
+}
+
+_emit_order = compile_schema(ORDER_SCHEMA, _unicode_filter)
+_emitters = {method: compile_schema(schema, _unicode_filter) for method, schema in XML_SCHEMAS.items()}
+
+#методы, у которых в выводе сам заказ, а не результат операции над ним с ключом 'order'
+order_id_methods = (Method.FBY_GET_ORDERS, Method.FBS_SET_STATUS, Method.GET_ORDER_INFO, Method.DBS_GET_ORDERS_FOR_CANCELLATION_APPROVE, Method.DBS_SET_STATUS)
+
+def _note_ids(xml_data, json_data, id_key: str):
+    """Pass order ids of the written objects to the output file's manifest entry."""
+    if not hasattr(xml_data, 'add_ids'):
+        return
+    objects = json_data if isinstance(json_data, list) else (json_data,)
+    xml_data.add_ids(obj['order'] if 'order' in obj else obj[id_key] for obj in objects if isinstance(obj, dict) and ('order' in obj or id_key in obj))
+
+def _tag_objects(xml_data, json_data):
+    """Add the output's own params (the campaign in multi-campaign runs) to the objects about to be written."""
+    params = xml_data.params if hasattr(xml_data, 'params') else None
+    if not params:
+        return
+    for obj in json_data if isinstance(json_data, list) else (json_data,):
+        if isinstance(obj, dict):
+            _add_params_to_dict(params, obj)
+
 def _order_to_xml(json_data, xml_data: list):
-    xml_data.append(' <order>')
-    for param in json_data.keys():
-        if param.startswith('_'):
-            xml_data.append('  <%s>%s</%s>' % (param, _unicode_filter(json_data[param]) ,param))    
-    for param in ('id','status','substatus','creationDate','currency','itemsTotal','total','deliveryTotal','subsidyTotal','paymentType','paymentMethod','fake','notes','taxSystem'):
-        if param in json_data:
-            xml_data.append('  <%s>%s</%s>' % (param, _unicode_filter(json_data[param]), param))
-    xml_data.append('  <delivery>')
-    for param in ('id','price','deliveryPartnerType','deliveryServiceId','serviceName','type','dispatchType'):
-        if param in json_data['delivery']:
-            xml_data.append('   <%s>%s</%s>' % (param, _unicode_filter(json_data['delivery'][param]), param))
-    xml_data.append('   <dates>')
-    for param in ('fromDate','toDate','fromTime','toTime'):
-        if param in json_data['delivery']['dates']:
-            xml_data.append('    <%s>%s</%s>' % (param, _unicode_filter(json_data['delivery']['dates'][param]), param))
-    xml_data.append('   </dates>')    
-    xml_data.append('   <region>')
-    for param in ('id','type','name'):
-        if param in json_data['delivery']['region']:
-            xml_data.append('    <%s>%s</%s>' % (param, _unicode_filter(json_data['delivery']['region'][param]), param))
-    xml_data.append('   </region>')
-    if 'address' in json_data['delivery']:
-        xml_data.append('   <address>')
-        for param in ('country','postcode','city','street','house','block','recipient'):
-            if param in json_data['delivery']['address']:
-                xml_data.append('    <%s>%s</%s>' % (param, _unicode_filter(json_data['delivery']['address'][param]), param))
-        xml_data.append('   </address>')
-    xml_data.append('   <shipments>')
-    for shipment in json_data['delivery']['shipments']:
-        xml_data.append('    <shipment>')
-        for param in ('id','shipmentDate','shipmentTime','status','weight','width','height','depth'):
-            if param in shipment:
-                xml_data.append('     <%s>%s</%s>' % (param, _unicode_filter(shipment[param]), param))    
-        if 'boxes' in shipment:
-            xml_data.append('     <boxes>')
-            for box in shipment['boxes']:
-                xml_data.append('      <box>')
-                for box_param in ('id','fulfilmentId','weight','width','height','depth'):
-                    if box_param in box:
-                        xml_data.append('       <%s>%s</%s>' % (box_param, _unicode_filter(box[box_param]), box_param))    
-                xml_data.append('      </box>')
-            xml_data.append('     </boxes>')
-        xml_data.append('    </shipment>')
-    xml_data.append('   </shipments>')
-    xml_data.append('  </delivery>')
-    if 'buyer' in json_data:
-        xml_data.append('  <buyer>')
-        for param in ('id','lastName','firstName','middleName','type'):
-            if param in json_data['buyer']:
-                xml_data.append('   <%s>%s</%s>' % (param, _unicode_filter(json_data['buyer'][param]), param))
-        xml_data.append('  </buyer>')
-    
-    xml_data.append('  <items>')
-    for item in json_data['items']:
-        xml_data.append('   <item>')
-        for param in ('id','offerId','count','price','vat','warehouseId','partnerWarehouseId','subsidy'):
-            if param in item:
-                xml_data.append('    <%s>%s</%s>' % (param, _unicode_filter(item[param]), param))    
-        if 'promos' in item:
-            xml_data.append('    <promos>')
-            for promo in item['promos']:
-                xml_data.append('     <promo>')
-                for param in ('marketPromoId','subsidy','type'):
-                    if param in promo:
-                        xml_data.append('      <%s>%s</%s>' % (param, _unicode_filter(promo[param]), param))    
-                xml_data.append('     </promo>')
-            xml_data.append('    </promos>')
-        if 'subsidies' in item:
-            xml_data.append('    <subsidies>')
-            for subsidy in item['subsidies']:
-                xml_data.append('     <subsidy>')
-                for param in ('amount','type'):
-                    if param in subsidy:
-                        xml_data.append('      <%s>%s</%s>' % (param, _unicode_filter(subsidy[param]), param))    
-                xml_data.append('     </subsidy>')
-            xml_data.append('    </subsidies>')
-        xml_data.append('   </item>')
-    xml_data.append('  </items>')
-    xml_data.append(' </order>')
+    _tag_objects(xml_data, json_data)
+    with metrics.timer('yandex_xml_duration_seconds', method=metrics.method or 'order'):
+        _emit_order(json_data, xml_data.append)
+    _note_ids(xml_data, json_data, 'id')
 
 
 def json_to_xml(method: Method, json_data, xml_data: list):
-    if method is Method.FBY_GET_ORDERS:
-        for order in json_data:
-            xml_data.append(' <fby_order>')
-            for param in order.keys():
-                if param.startswith('_'):
-                    xml_data.append('  <param%s>%s</param%s>' % (param, _unicode_filter(order[param]) ,param))    
-            for param in ('id','creationDate','status','statusUpdateDate','paymentType'):
-                if param in order and order[param]:
-                    xml_data.append('  <%s>%s</%s>' % (param, _unicode_filter(order[param]) ,param))
-            xml_data.append('  <items>')
-            for item in order['items']:
-                xml_data.append('   <item>')
-                for param in ('shopSku','marketSku','count'):
-                    if param in item and item[param]:
-                        xml_data.append('    <%s>%s</%s>' % (param, _unicode_filter(item[param]) ,param))
-                xml_data.append('    <prices>')
-                for price in item['prices']:
-                    xml_data.append('     <price>')
-                    for price_param in ('type','costPerItem','total'):
-                        if price_param in price and price[price_param]:
-                            xml_data.append('      <%s>%s</%s>' % (price_param, _unicode_filter(price[price_param]) ,price_param))
-                    xml_data.append('     </price>')
-                xml_data.append('    </prices>')
-                xml_data.append('   </item>')
-            xml_data.append('  </items>')
-            xml_data.append(' </fby_order>')
-    
-    elif method is Method.FBS_SET_STATUS:
-        _order_to_xml(json_data, xml_data)
-    
-    elif method is Method.FBS_SET_BOXES:
-        xml_data.append('<order>')
-        xml_data.append(' <id>%s</id>' % _unicode_filter(json_data['order']))
-        xml_data.append(' <boxes>')
-        for box in json_data['boxes']:
-            xml_data.append('  <box>')
-            for param in ('id','fulfilmentId','weight','width','height','depth'):
-                if param in box:
-                    xml_data.append('   <%s>%s</%s>' % (param, _unicode_filter(box[param]) ,param))
-            xml_data.append('  </box>')
-        xml_data.append(' </boxes>')
-        xml_data.append('</order>')
-    
-    elif method is Method.GET_ORDER_INFO:
-        _order_to_xml(json_data, xml_data)
-
-    elif method is Method.GET_BUYER_INFO:
-        xml_data.append('<buyer-info>')
-        xml_data.append(' <order>%s</order>' % _unicode_filter(json_data['order']))
-        for param in ('id','lastName','firstName','middleName','phone'):
-            if param in json_data:
-                xml_data.append(' <%s>%s</%s>' % (param, _unicode_filter(json_data[param]) ,param))
-        xml_data.append('</buyer-info>')
-
-    elif method is Method.SET_PRICES:
-        xml_data.append('<set-prices>')
-        for param in json_data.keys():
-            if param.startswith('_'):
-                xml_data.append('<%s>%s</%s>' % (param, _unicode_filter(json_data[param]) ,param))    
-        xml_data.append(' <status>%s</status>' % json_data['status'])
-        if 'errors' in json_data:
-            xml_data.append(' <errors>')
-            for error in json_data['errors']:
-                xml_data.append('  <error>')
-                for param in ('code','message'):
-                    if param in error:
-                        xml_data.append('   <%s>%s</%s>' % (param, _unicode_filter(error[param]) ,param))
-                xml_data.append('  </error>')
-            xml_data.append(' </errors>')
-        
-        xml_data.append('</set-prices>')
-
-    elif method is Method.DBS_GET_ORDERS_FOR_CANCELLATION_APPROVE:
-        for order in json_data:
-            xml_data.append(' <dbs_order>')
-            for param in ('id','status','substatus'):
-                if param in order and order[param]:
-                    xml_data.append('  <%s>%s</%s>' % (param, _unicode_filter(order[param]) ,param))
-            xml_data.append(' </dbs_order>')
-    
-    elif method is Method.DBS_CHANGE_DATE:
-        xml_data.append(' <dbs_change_date>')
-        for param in json_data:
-            xml_data.append('  <%s>%s</%s>' % (param, _unicode_filter(json_data[param]) ,param))
-        xml_data.append(' </dbs_change_date>')
-    
-    elif method is Method.DBS_SET_STATUS:
-        _order_to_xml(json_data, xml_data)
-    
-    elif method is Method.YD_CREATE_OFFER:
-        xml_data.append('<yd-create-offer>')
-        for param in json_data.keys():
-            if param.startswith('_'):
-                xml_data.append('<%s>%s</%s>' % (param, _unicode_filter(json_data[param]) ,param))    
-        
-        if 'error_details' in json_data:
-            xml_data.append(' <errors>')
-            for error in json_data['error_details']:
-                xml_data.append('  <error>%s</error>' % _unicode_filter(error))
-            xml_data.append(' </errors>')
-        else:
-            for param in ('operator_request_id','pickup_interval_min','pickup_interval_max','request_id'):
-                if param in json_data:
-                    xml_data.append(' <%s>%s</%s>' % (param, _unicode_filter(json_data[param]), param))
-        
-        xml_data.append('</yd-create-offer>')
-
-    elif method is Method.YD_CANCEL_OFFER:
-        xml_data.append('<yd-cancel-offer>')
-        xml_data.append(' <request_id>%s</request_id>' % _unicode_filter(json_data['request_id']))
-        xml_data.append(' <timestamp>%s</timestamp>' % datetime.strftime(datetime.now(), "%d-%m-%Y %H:%M:%S"))
-        xml_data.append('</yd-cancel-offer>')
-
-    elif method is Method.YD_OFFER_INFO:
-        xml_data.append('<yd-offer-info>')
-        xml_data.append(' <request_id>%s</request_id>' % _unicode_filter(json_data['request_id']))
-        for param in ('timestamp','status','sharing_url','total_without_vat'):
-            if param in json_data:
-                xml_data.append(' <%s>%s</%s>' % (param, _unicode_filter(json_data[param]) ,param))
-        
-        xml_data.append('</yd-offer-info>')
+    if method in _emitters:
+        _tag_objects(xml_data, json_data)
+        with metrics.timer('yandex_xml_duration_seconds', method=method.value):
+            _emitters[method](json_data, xml_data.append)
+        _note_ids(xml_data, json_data, 'id' if method in order_id_methods else 'order')
+
+
+def _after_write(xml, callback):
+    """Run callback after the output file is written, or right away when there is no file behind xml."""
+    if hasattr(xml, 'on_commit'):
+        xml.on_commit(callback)
+    else:
+        callback()
+
+fby_prefetch_pages = 2
 
+def _offer_page(pages: Queue, stop: threading.Event, page):
+    while not stop.is_set():
+        try:
+            pages.put(page, timeout=1)
+            return
+        except Full:
+            continue
+
+def _fetch_fby_pages(campaign_id: str, body, headers, pages: Queue, stop: threading.Event):
+    page_token = None
+    while not stop.is_set():
+        if page_token:
+            url = f"{host_market}/v2/campaigns/{campaign_id}/stats/orders.json?limit=200&page_token={page_token}"    
+        else:
+            url = f"{host_market}/v2/campaigns/{campaign_id}/stats/orders.json?limit=200"
+        started = time()
+        result = post_query(url, body, headers, retry=True)
+        fetch_time = time() - started
+        page_token = None
+        error = None
+        try:
+            if result.success and 'paging' in result.response['result'] and 'nextPageToken' in result.response['result']['paging']:
+                page_token = result.response['result']['paging']['nextPageToken']
+        except Exception as ex:
+            error = ex
+        _offer_page(pages, stop, (url, result, fetch_time, error))
+        if not page_token:
+            break
+    _offer_page(pages, stop, None)
 
 def fby_get_orders(client_id: str, token: str, campaign_id: str, xml: list, data) -> bool:
     headers = {'Content-Type': 'application/json', 'Cache-Control': 'no-cache', 'Authorization': f'OAuth oauth_token="{token}", oauth_client_id="{client_id}"'}
@@ -349,50 +325,83 @@ def fby_get_orders(client_id: str, token: str, campaign_id: str, xml: list, data
     body = data
     strings_exist = False
     only_statuses = ('DELIVERED','RETURNED','REJECTED','PICKUP','DELIVERY','CANCELLED_IN_PROCESSING')
-    page_token = None
-    while True:
-        if page_token:
-            url = f"{host_market}/v2/campaigns/{campaign_id}/stats/orders.json?limit=200&page_token={page_token}"    
-        else:
-            url = f"{host_market}/v2/campaigns/{campaign_id}/stats/orders.json?limit=200"
-        result = post_query(url, body, headers)
-        if not result.success:
-            if result.data:
-                log_error.error('Status: %s. Error: %s',result.status,result.data)
-            else:
-                log_error.error('%s%s',('Status: ' + result.status +'. ') if result.status else '',result.error_message)
-            return False
+    sync_path = data['sync_state'] if 'sync_state' in data and data['sync_state'] else None
+    if sync_path:
+        state = load_state(sync_path)
+        checkpoint = state[str(campaign_id)] if str(campaign_id) in state else {'update_from': '', 'orders': {}}
+        body = {key: value for key, value in data.items() if key != 'sync_state'}
+        if checkpoint['update_from']:
+            body.pop('dateFrom', None)
+            body.pop('dateTo', None)
+            body['updateFrom'] = checkpoint['update_from']
+            body['updateTo'] = datetime.now().strftime('%Y-%m-%d')
+        latest_update = checkpoint['update_from']
+        known = checkpoint['orders']
+        seen = {}
+    pages = Queue(maxsize=fby_prefetch_pages)
+    stop = threading.Event()
+    fetcher = threading.Thread(target=_fetch_fby_pages, args=(campaign_id, body, headers, pages, stop), daemon=True)
+    fetcher.start()
+    page_number = 0
+    try:
+        while True:
+            page = pages.get()
+            if page is None:
+                break
+            url, result, fetch_time, error = page
+            page_number += 1
+            if not result.success:
+                _log_query_error(result)
+                return False
 
-        log_info.info('URL %s, body %s, status %s, response status %s', url, str(body), result.status, result.response['status'] if 'status' in result.response else '')
-        if 'result' in result.response and 'orders' in result.response['result']:
-            log_info.info('orders %s', len(result.response['result']['orders']))
-        
-        try:
-            if 'result' in result.response:
-                orders = [order for order in result.response['result']['orders'] if 'status' in order and order['status'] in only_statuses]
-            else:
-                orders = []
+            log_info.info('URL %s, body %s, status %s, response status %s', url, Payload(body, Method.FBY_GET_ORDERS), result.status, result.response['status'] if 'status' in result.response else '')
+            if 'result' in result.response and 'orders' in result.response['result']:
+                log_info.info('orders %s', len(result.response['result']['orders']))
+            
+            started = time()
+            try:
+                if 'result' in result.response:
+                    orders = [order for order in result.response['result']['orders'] if 'status' in order and order['status'] in only_statuses]
+                else:
+                    orders = []
+
+                if sync_path:
+                    for order in result.response['result']['orders'] if 'result' in result.response else []:
+                        if 'statusUpdateDate' in order and order['statusUpdateDate']:
+                            latest_update = max(latest_update, str(order['statusUpdateDate'])[:10])
+                            seen[str(order['id'])] = [order['status'] if 'status' in order else '', str(order['statusUpdateDate'])[:10]]
+                    orders = [order for order in orders if str(order['statusUpdateDate'] if 'statusUpdateDate' in order else '')[:10] >= checkpoint['update_from']
+                              and (str(order['id']) not in known or known[str(order['id'])][0] != order['status'])]
 
-            if 'params' in data:
-                for param in dict(data['params']).keys():                    
-                    for order in orders:
-                        order['_%s' % str(param)] = data['params'][param]                
+                if 'params' in data:
+                    for param in dict(data['params']).keys():                    
+                        for order in orders:
+                            order['_%s' % str(param)] = data['params'][param]                
 
-            if orders:
-                json_to_xml(Method.FBY_GET_ORDERS, orders, xml)
-                strings_exist = True
-        except Exception as ex:
-            log_error.error('%s', str(ex))
-            return False
+                if orders:
+                    json_to_xml(Method.FBY_GET_ORDERS, orders, xml)
+                    strings_exist = True
+            except Exception as ex:
+                log_error.error('%s', str(ex))
+                return False
+            log_info.info('Page %s: fetch %.3f s, convert %.3f s', page_number, fetch_time, time() - started)
 
-        page_token = None
-        if 'paging' in result.response['result'] and 'nextPageToken' in result.response['result']['paging']:
-            page_token = result.response['result']['paging']['nextPageToken']
-        else:
-            break
+            if error:
+                raise error
+    finally:
+        stop.set()
 
     xml.append('</fby_orders>')
 
+    if sync_path:
+        known.update(seen)
+        #заказы старше начала следующего окна уже не придут повторно
+        checkpoint = {'update_from': latest_update, 'orders': {order_id: known[order_id] for order_id in known if known[order_id][1] >= latest_update}}
+        if strings_exist:
+            _after_write(xml, lambda: update_state(sync_path, str(campaign_id), checkpoint))
+        else:
+            update_state(sync_path, str(campaign_id), checkpoint)
+
     return strings_exist
 
 def fbs_set_status(client_id: str, token: str, campaign_id: str, xml: list, data) -> bool:
@@ -408,15 +417,13 @@ def fbs_set_status(client_id: str, token: str, campaign_id: str, xml: list, data
         body = {}
 
     result = put_query(url, body, headers)
+    _invalidate_order(campaign_id, data['order'])
     if not result.success:
-        if result.data:
-            log_error.error('Status: %s. Error: %s',result.status,result.data)
-        else:
-            log_error.error('%s%s',('Status: ' + result.status +'. ') if result.status else '',result.error_message)
+        _log_query_error(result)
         return False
 
-    log_info.info('URL %s, body %s, status %s', url, str(body), result.status)
-    log_info.info('Response %s', result.response)
+    log_info.info('URL %s, body %s, status %s', url, Payload(body, Method.FBS_SET_STATUS), result.status)
+    log_info.info('Response %s', Payload(result.response, Method.FBS_SET_STATUS))
 
     order = result.response['order'] if 'order' in result.response else {}
     
@@ -445,15 +452,13 @@ def fbs_set_boxes(client_id: str, token: str, campaign_id: str, xml: list, data)
         body = {}
 
     result = put_query(url, body, headers)
+    _invalidate_order(campaign_id, data['order'])
     if not result.success:
-        if result.data:
-            log_error.error('Status: %s. Error: %s',result.status,result.data)
-        else:
-            log_error.error('%s%s',('Status: ' + result.status +'. ') if result.status else '',result.error_message)
+        _log_query_error(result)
         return False
 
-    log_info.info('URL %s, body %s, status %s, response status %s', url, str(body), result.status, result.response['status'] if 'status' in result.response else '')
-    log_info.info('Response %s', result.response)
+    log_info.info('URL %s, body %s, status %s, response status %s', url, Payload(body, Method.FBS_SET_BOXES), result.status, result.response['status'] if 'status' in result.response else '')
+    log_info.info('Response %s', Payload(result.response, Method.FBS_SET_BOXES))
     if 'result' in result.response and 'boxes' in result.response['result']:
         log_info.info('boxes %s', len(result.response['result']['boxes']))
         boxes = result.response['result']['boxes']
@@ -471,21 +476,153 @@ def fbs_set_boxes(client_id: str, token: str, campaign_id: str, xml: list, data)
 
     return strings_exist
 
+bulk_workers = 8
+bulk_rate = 0 #запросов в секунду, 0 - без ограничения
+
+def _query_error_text(result: QueryResponse) -> str:
+    return '%s%s' % (('Status: %s. ' % result.status) if result.status else '', result.data if result.data else result.error_message)
+
+def _run_bulk(entries: list, handle: Callable, data) -> list:
+    """Run handle(entry) for every entry on a bounded pool, spacing the calls by the rate limit."""
+    limiter = RateLimiter(float(data['rate']) if 'rate' in data else bulk_rate)
+    def run(entry):
+        limiter.wait()
+        try:
+            return handle(entry)
+        except Exception as ex:
+            log_error.error('%s', str(ex))
+            return {'order': entry['order'] if isinstance(entry, dict) and 'order' in entry else '', 'result': 'ERROR', 'error': str(ex)}
+    with ThreadPoolExecutor(max_workers=int(data['workers']) if 'workers' in data else bulk_workers) as executor:
+        return list(executor.map(run, entries))
+
+def fbs_set_boxes_bulk(client_id: str, token: str, campaign_id: str, xml: list, data) -> bool:
+    headers = {'Content-Type': 'application/json', 'Cache-Control': 'no-cache', 'Authorization': f'OAuth oauth_token="{token}", oauth_client_id="{client_id}"'}
+
+    def set_boxes(entry: dict) -> dict:
+        url = f"{host_market}/v2/campaigns/{campaign_id}/orders/{entry['order']}/delivery/shipments/{entry['shipment']}/boxes.json"
+        body = {'boxes': entry['boxes']} if 'boxes' in entry else {}
+        result = put_query(url, body, headers)
+        _invalidate_order(campaign_id, entry['order'])
+        if not result.success:
+            _log_query_error(result)
+            return {'order': entry['order'], 'result': 'ERROR', 'error': _query_error_text(result)}
+        log_info.info('URL %s, status %s, response status %s', url, result.status, result.response['status'] if 'status' in result.response else '')
+        boxes = result.response['result']['boxes'] if 'result' in result.response and 'boxes' in result.response['result'] else []
+        return {'order': entry['order'], 'result': 'OK', 'boxes': boxes}
+
+    results = _run_bulk(data['orders'], set_boxes, data)
+    log_info.info('fbs_set_boxes_bulk: %s orders, %s failed', len(results), len([result for result in results if result['result'] != 'OK']))
+
+    try:
+        if 'params' in data:
+            for result in results:
+                _add_params_to_dict(data['params'], result)
+        xml.append('<?xml version="1.0" encoding="windows-1251"?>')
+        xml.append('<fbs_boxes>')
+        json_to_xml(Method.FBS_SET_BOXES_BULK, results, xml)
+        xml.append('</fbs_boxes>')
+    except Exception as ex:
+        log_error.error('%s', str(ex))
+        return False
+
+    return bool(results)
+
+orders_status_bulk_size = 30
+
+def _status_body(entry: dict) -> dict:
+    if entry['status'] == Status.SET_READY.value:
+        return {'status': 'PROCESSING', 'substatus': 'READY_TO_SHIP'}
+    body = {'status': entry['status']}
+    if 'substatus' in entry:
+        body['substatus'] = entry['substatus']
+    return body
+
+def orders_set_status(client_id: str, token: str, campaign_id: str, xml: list, data) -> bool:
+    headers = {'Content-Type': 'application/json', 'Cache-Control': 'no-cache', 'Authorization': f'OAuth oauth_token="{token}", oauth_client_id="{client_id}"'}
+    url = f"{host_market}/v2/campaigns/{campaign_id}/orders/status-update.json"
+    bulk_size = int(data['bulk_size']) if 'bulk_size' in data else orders_status_bulk_size
+    results = {}
+    single = []
+
+    for chunk in _batches(data['orders'], bulk_size):
+        body = {'orders': [dict(_status_body(entry), id=entry['order']) for entry in chunk]}
+        result = post_query(url, body, headers)
+        if not result.success:
+            _log_query_error(result)
+            single.extend(chunk)
+            continue
+        log_info.info('URL %s, status %s, orders %s', url, result.status, len(chunk))
+        updated = result.response['result']['orders'] if 'result' in result.response and 'orders' in result.response['result'] else []
+        for order in updated:
+            results[str(order['id'])] = {
+                'order': order['id'],
+                'status': order['status'] if 'status' in order else '',
+                'substatus': order['substatus'] if 'substatus' in order else '',
+                'result': 'OK' if 'updateStatus' in order and order['updateStatus'] == 'OK' else 'ERROR',
+                'error': order['errorDetails'] if 'errorDetails' in order else ''}
+        single.extend(entry for entry in chunk if str(entry['order']) not in results)
+
+    def set_status(entry: dict) -> dict:
+        order_url = f"{host_market}/v2/campaigns/{campaign_id}/orders/{entry['order']}/status.json"
+        result = put_query(order_url, {'order': _status_body(entry)}, headers)
+        if not result.success:
+            _log_query_error(result)
+            return {'order': entry['order'], 'result': 'ERROR', 'error': _query_error_text(result)}
+        order = result.response['order'] if 'order' in result.response else {}
+        return {'order': entry['order'], 'status': order['status'] if 'status' in order else '', 'substatus': order['substatus'] if 'substatus' in order else '', 'result': 'OK'}
+
+    if single:
+        log_info.info('Updating %s orders one by one', len(single))
+        for result in _run_bulk(single, set_status, data):
+            results[str(result['order'])] = result
+
+    for entry in data['orders']:
+        _invalidate_order(campaign_id, entry['order'])
+
+    statuses = [results[str(entry['order'])] for entry in data['orders'] if str(entry['order']) in results]
+    failed = [status['order'] for status in statuses if status['result'] != 'OK']
+    log_info.info('orders_set_status: %s orders, %s failed', len(statuses), len(failed))
+
+    failed_orders = []
+    if failed and 'with_failed_orders' in data and data['with_failed_orders']:
+        def fetch(order_id):
+            result = get_query(f"{host_market}/v2/campaigns/{campaign_id}/orders/{order_id}.json", headers)
+            if not result.success:
+                _log_query_error(result)
+                return {'order': order_id, 'result': 'ERROR'}
+            return {'order': order_id, 'result': 'OK', 'data': result.response['order'] if 'order' in result.response else {}}
+        failed_orders = [result['data'] for result in _run_bulk(failed, fetch, data) if 'data' in result and result['data']]
+
+    try:
+        if 'params' in data:
+            for status in statuses:
+                _add_params_to_dict(data['params'], status)
+            for order in failed_orders:
+                _add_params_to_dict(data['params'], order)
+        xml.append('<?xml version="1.0" encoding="windows-1251"?>')
+        xml.append('<orders_status>')
+        json_to_xml(Method.ORDERS_SET_STATUS, statuses, xml)
+        for order in failed_orders:
+            _order_to_xml(order, xml)
+        xml.append('</orders_status>')
+    except Exception as ex:
+        log_error.error('%s', str(ex))
+        return False
+
+    return bool(statuses)
+
 def get_order_info(client_id: str, token: str, campaign_id: str, xml: list, data) -> bool:
     headers = {'Content-Type': 'application/json', 'Cache-Control': 'no-cache', 'Authorization': f'OAuth oauth_token="{token}", oauth_client_id="{client_id}"'}
     strings_exist = False
     url = f"{host_market}/v2/campaigns/{campaign_id}/orders/{data['order']}.json"
     
-    result = get_query(url, headers)
+    result = _cached_get_query(Method.GET_ORDER_INFO, campaign_id, data['order'], url, headers)
     if not result.success:
-        if result.data:
-            log_error.error('Status: %s. Error: %s',result.status,result.data)
-        else:
-            log_error.error('%s%s',('Status: ' + result.status +'. ') if result.status else '',result.error_message)
+        _log_query_error(result)
         return False
 
     log_info.info('URL %s, status %s, response status %s', url, result.status, result.response['status'] if 'status' in result.response else '')
-    log_info.info('Response %s', result.response)
+    log_info.info('Response %s', Payload(result.response, Method.GET_ORDER_INFO))
     
     order = result.response['order'] if 'order' in result.response else {}
     
@@ -504,21 +641,77 @@ def get_order_info(client_id: str, token: str, campaign_id: str, xml: list, data
 
     return strings_exist
 
+orders_info_page_size = 50
+orders_info_workers = 8
+
+def get_orders_info(client_id: str, token: str, campaign_id: str, xml: list, data) -> bool:
+    headers = {'Content-Type': 'application/json', 'Cache-Control': 'no-cache', 'Authorization': f'OAuth oauth_token="{token}", oauth_client_id="{client_id}"'}
+    strings_exist = False
+    order_ids = [str(order_id) for order_id in data['orders']]
+    orders = {}
+
+    for chunk in _batches(order_ids, orders_info_page_size):
+        page = 1
+        while True:
+            url = f"{host_market}/v2/campaigns/{campaign_id}/orders.json?orderIds={','.join(chunk)}&page={page}&pageSize={orders_info_page_size}"
+            result = get_query(url, headers)
+            if not result.success:
+                _log_query_error(result)
+                break
+            log_info.info('URL %s, status %s, orders %s', url, result.status, len(result.response['orders']) if 'orders' in result.response else 0)
+            for order in result.response['orders'] if 'orders' in result.response else []:
+                orders[str(order['id'])] = order
+                if response_cache:
+                    response_cache.put(Method.GET_ORDER_INFO.value, campaign_id, order['id'], {'order': order})
+            pager = result.response['pager'] if 'pager' in result.response else {}
+            if 'pagesCount' in pager and page < pager['pagesCount']:
+                page += 1
+            else:
+                break
+
+    missing = [order_id for order_id in order_ids if order_id not in orders]
+    if missing:
+        log_info.info('Fetching %s orders one by one', len(missing))
+        def fetch(order_id):
+            url = f"{host_market}/v2/campaigns/{campaign_id}/orders/{order_id}.json"
+            return order_id, _cached_get_query(Method.GET_ORDER_INFO, campaign_id, order_id, url, headers)
+        with ThreadPoolExecutor(max_workers=orders_info_workers) as executor:
+            for order_id, result in executor.map(fetch, missing):
+                if not result.success:
+                    _log_query_error(result)
+                elif 'order' in result.response:
+                    orders[order_id] = result.response['order']
+
+    try:
+        xml.append('<?xml version="1.0" encoding="windows-1251"?>')
+        xml.append('<orders>')
+        for order_id in order_ids:
+            if order_id not in orders:
+                continue
+            order = orders[order_id]
+            if 'params' in data:
+                _add_params_to_dict(data['params'], order)
+            _order_to_xml(order, xml)
+            strings_exist = True
+        xml.append('</orders>')
+    except Exception as ex:
+        log_error.error('%s', str(ex))
+        return False
+
+    return strings_exist
+
 def get_buyer_info(client_id: str, token: str, campaign_id: str, xml: list, data) -> bool:
     headers = {'Content-Type': 'application/json', 'Cache-Control': 'no-cache', 'Authorization': f'OAuth oauth_token="{token}", oauth_client_id="{client_id}"'}
     strings_exist = False
     url = f"{host_market}/v2/campaigns/{campaign_id}/orders/{data['order']}/buyer.json"
     
-    result = get_query(url, headers)
+    result = _cached_get_query(Method.GET_BUYER_INFO, campaign_id, data['order'], url, headers)
     if not result.success:
-        if result.data:
-            log_error.error('Status: %s. Error: %s',result.status,result.data)
-        else:
-            log_error.error('%s%s',('Status: ' + result.status +'. ') if result.status else '',result.error_message)
+        _log_query_error(result)
         return False
 
     log_info.info('URL %s, status %s, response status %s', url, result.status, result.response['status'] if 'status' in result.response else '')
-    log_info.info('Response %s', result.response)
+    log_info.info('Response %s', Payload(result.response, Method.GET_BUYER_INFO))
     
     buyer = result.response['result'] if 'result' in result.response else {}
 
@@ -534,43 +727,127 @@ def get_buyer_info(client_id: str, token: str, campaign_id: str, xml: list, data
 
     return strings_exist
 
-def set_prices(client_id: str, token: str, campaign_id: str, xml: list, data) -> bool:
-    headers = {'Content-Type': 'application/json', 'Cache-Control': 'no-cache', 'Authorization': f'OAuth oauth_token="{token}", oauth_client_id="{client_id}"'}
-    strings_exist = False
-    url = f"{host_market}/v2/campaigns/{campaign_id}/offer-prices/updates.json"
-    
-    if 'prices' in data:
-        body = {'offers': data['prices']}
-    else:
-        body = {}
+set_prices_batch_size = 500
+set_prices_workers = 4
+set_prices_rate = 0 #запросов в секунду, 0 - без ограничения
 
-    result = post_query(url, body, headers)
+def _csv_value(value: str):
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+def _read_prices_file(path: str):
+    """Offers from a JSON Lines file (one offer per line) or a CSV file with dotted headers like price.value."""
+    if path.lower().endswith('.csv'):
+        with open(path, 'r', encoding='utf-8-sig', newline='') as prices_file:
+            for row in csv.DictReader(prices_file):
+                offer = {}
+                for column, value in row.items():
+                    if not column or value is None or value == '':
+                        continue
+                    target = offer
+                    keys = column.split('.')
+                    for key in keys[:-1]:
+                        target = target.setdefault(key, {})
+                    #числа только в полях цены, id и SKU остаются строками (00123 не превращается в 123)
+                    target[keys[-1]] = _csv_value(value) if keys[0] == 'price' and not keys[-1].endswith('Id') else value
+                yield offer
+    else:
+        with open(path, 'r', encoding='utf-8') as prices_file:
+            for line in prices_file:
+                line = line.strip()
+                if line:
+                    yield json_codec.loads(line)
+
+def _batches(iterable, size: int):
+    batch = []
+    for element in iterable:
+        batch.append(element)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _post_prices_batch(url: str, body: dict, headers, limiter: RateLimiter):
+    """Returns (body, response dict) or (body, None) when the batch failed without an API error report."""
+    limiter.wait()
+    result = post_query(url, body, headers, retry=True)
     if not result.success:
         try:
             error_data = json.loads(result.data)
         except Exception as ex:
             error_data = {}
-        
+
         if result.status == 400 and 'status' in error_data:
-            try:
-                if 'params' in data:
-                    _add_params_to_dict(data['params'], error_data)
-                xml.append('<?xml version="1.0" encoding="windows-1251"?>')
-                json_to_xml(Method.SET_PRICES, error_data, xml)
-                strings_exist = True
-                return True
-            except Exception as ex:
-                log_error.error('%s', str(ex))
-                return False
-        elif result.data:
-            log_error.error('Status: %s. Error: %s',result.status,result.data)
+            return body, error_data
         else:
-            log_error.error('%s%s',('Status: ' + result.status +'. ') if result.status else '',result.error_message)
+            _log_query_error(result)
+        return body, None
+
+    log_info.info('Response %s', Payload(result.response, Method.SET_PRICES))
+    return body, dict(result.response)
+
+def set_prices(client_id: str, token: str, campaign_id: str, xml: list, data) -> bool:
+    headers = {'Content-Type': 'application/json', 'Cache-Control': 'no-cache', 'Authorization': f'OAuth oauth_token="{token}", oauth_client_id="{client_id}"'}
+    strings_exist = False
+    url = f"{host_market}/v2/campaigns/{campaign_id}/offer-prices/updates.json"
+
+    if 'prices' in data:
+        offers = data['prices']
+    elif 'prices_file' in data:
+        offers = _read_prices_file(data['prices_file'])
+    else:
+        offers = None
+
+    cache = PriceCache(data['price_cache']) if 'price_cache' in data and data['price_cache'] else None
+    if cache and offers is not None and not ('full_resync' in data and data['full_resync']):
+        offers = cache.changed(campaign_id, offers)
+
+    batch_size = int(data['batch_size']) if 'batch_size' in data else set_prices_batch_size
+    workers = int(data['workers']) if 'workers' in data else set_prices_workers
+    limiter = RateLimiter(float(data['rate']) if 'rate' in data else set_prices_rate)
+    bodies = ({'offers': batch} for batch in _batches(offers, batch_size)) if offers is not None else iter([{}])
+
+    responses = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for body in bodies:
+            pending.append(executor.submit(_post_prices_batch, url, body, headers, limiter))
+            if len(pending) >= workers * 2:
+                responses.append(pending.popleft().result())
+        while pending:
+            responses.append(pending.popleft().result())
+
+    if cache:
+        try:
+            for body, response in responses:
+                if response and 'offers' in body and 'status' in response and response['status'] == 'OK':
+                    cache.store(campaign_id, body['offers'])
+        finally:
+            cache.close()
+
+    if responses and all(response is None for _, response in responses):
         return False
 
-    log_info.info('Response %s', result.response)
+    response_data = {'status': 'OK'}
+    errors = []
+    for body, response in responses:
+        if response is None:
+            response_data['status'] = 'ERROR'
+            errors.append({'code': 'BATCH_FAILED', 'message': '%s offers not sent' % len(body['offers']) if 'offers' in body else 'Request not sent'})
+            continue
+        if 'status' in response and response['status'] != 'OK':
+            response_data['status'] = response['status']
+        if 'errors' in response:
+            errors.extend(response['errors'])
+    if errors:
+        response_data['errors'] = errors
+    log_info.info('set_prices: %s batches, status %s, errors %s', len(responses), response_data['status'], len(errors))
 
-    response_data = dict(result.response)
     try:
         if 'params' in data:
             _add_params_to_dict(data['params'], response_data)        
@@ -589,54 +866,77 @@ def dbs_get_orders_for_cancellation_approve(client_id: str, token: str, campaign
     xml.append('<?xml version="1.0" encoding="windows-1251"?>')
     xml.append('<dbs_orders_for_cancellation_approve>')
     strings_exist = False
-    url = f"{host_market}/v2/campaigns/{campaign_id}/orders?onlyWaitingForCancellationApprove=true"
-    result = get_query(url, headers)
-    if not result.success:
-        if result.data:
-            log_error.error('Status: %s. Error: %s',result.status,result.data)
+    state_path = data['state_file'] if 'state_file' in data and data['state_file'] else None
+    state = load_state(state_path) if state_path else {}
+    emitted = state[str(campaign_id)] if str(campaign_id) in state else {}
+    waiting = {}
+    page = 1
+    while True:
+        url = f"{host_market}/v2/campaigns/{campaign_id}/orders?onlyWaitingForCancellationApprove=true&page={page}"
+        result = get_query(url, headers)
+        if not result.success:
+            _log_query_error(result)
+            return False
+
+        log_info.info('URL %s, status %s, response status %s', url, result.status, result.response['status'] if 'status' in result.response else '')
+        if 'orders' in result.response:
+            log_info.info('orders %s', len(result.response['orders']))
+            orders = result.response['orders']
         else:
-            log_error.error('%s%s',('Status: ' + result.status +'. ') if result.status else '',result.error_message)
-        return False
+            orders = []
 
-    log_info.info('URL %s, status %s, response status %s', url, result.status, result.response['status'] if 'status' in result.response else '')
-    if 'orders' in result.response:
-        log_info.info('orders %s', len(result.response['orders']))
-        orders = result.response['orders']
-    else:
-        orders = []
-    
-    try:
-        if orders:
-            json_to_xml(Method.DBS_GET_ORDERS_FOR_CANCELLATION_APPROVE, orders, xml)
-            strings_exist = True
-    except Exception as ex:
-        log_error.error('%s', str(ex))
-        return False
+        if state_path:
+            for order in orders:
+                waiting[str(order['id'])] = str(order['substatus']) if 'substatus' in order else ''
+            orders = [order for order in orders if str(order['id']) not in emitted or emitted[str(order['id'])] != waiting[str(order['id'])]]
+        
+        try:
+            if 'params' in data:
+                for order in orders:
+                    _add_params_to_dict(data['params'], order)
+            if orders:
+                json_to_xml(Method.DBS_GET_ORDERS_FOR_CANCELLATION_APPROVE, orders, xml)
+                strings_exist = True
+        except Exception as ex:
+            log_error.error('%s', str(ex))
+            return False
+
+        pager = result.response['pager'] if 'pager' in result.response else {}
+        if 'pagesCount' in pager and page < pager['pagesCount']:
+            page += 1
+        else:
+            break
 
     xml.append('</dbs_orders_for_cancellation_approve>')
 
+    if state_path:
+        if strings_exist:
+            _after_write(xml, lambda: update_state(state_path, str(campaign_id), waiting))
+        elif waiting != emitted:
+            update_state(state_path, str(campaign_id), waiting)
+
     return strings_exist
 
 def dbs_cancellation_accept(client_id: str, token: str, campaign_id: str, xml: list, data) -> bool:
     body = {'accepted': data['accepted']}
     if 'reason' in data:
         body['reason'] = data['reason']
-    return _put_without_xml(f"{host_market}/v2/campaigns/{campaign_id}/orders/{data['order']}/cancellation/accept", body, {'Content-Type': 'application/json', 'Cache-Control': 'no-cache', 'Authorization': f'OAuth oauth_token="{token}", oauth_client_id="{client_id}"'})
+    result = _put_without_xml(f"{host_market}/v2/campaigns/{campaign_id}/orders/{data['order']}/cancellation/accept", body, {'Content-Type': 'application/json', 'Cache-Control': 'no-cache', 'Authorization': f'OAuth oauth_token="{token}", oauth_client_id="{client_id}"'})
+    _invalidate_order(campaign_id, data['order'])
+    return result
 
 def dbs_change_date(client_id: str, token: str, campaign_id: str, xml: list, data) -> bool:
     headers = {'Content-Type': 'application/json', 'Cache-Control': 'no-cache', 'Authorization': f'OAuth oauth_token="{token}", oauth_client_id="{client_id}"'}
     strings_exist = False
     url = f"{host_market}/campaigns/{campaign_id}/orders/{data['order_id']}/delivery/date"
     result = put_query(url, data, headers)
+    _invalidate_order(campaign_id, data['order_id'])
     if not result.success:
-        if result.data:
-            log_error.error('Status: %s. Error: %s',result.status,result.data)
-        else:
-            log_error.error('%s%s',('Status: ' + result.status +'. ') if result.status else '',result.error_message)
+        _log_query_error(result)
         return False
 
-    log_info.info('URL %s, body %s, status %s', url, str(data), result.status)
-    log_info.info('Response %s', result.response)
+    log_info.info('URL %s, body %s, status %s', url, Payload(data, Method.DBS_CHANGE_DATE), result.status)
+    log_info.info('Response %s', Payload(result.response, Method.DBS_CHANGE_DATE))
 
     if 'status' not in result.response or result.response['status']!='OK':
         return False
@@ -666,15 +966,13 @@ def dbs_set_status(client_id: str, token: str, campaign_id: str, xml: list, data
     strings_exist = False
     url = f"{host_market}/campaigns/{campaign_id}/orders/{data['order_id']}/status"
     result = put_query(url, data, headers)
+    _invalidate_order(campaign_id, data['order_id'])
     if not result.success:
-        if result.data:
-            log_error.error('Status: %s. Error: %s',result.status,result.data)
-        else:
-            log_error.error('%s%s',('Status: ' + result.status +'. ') if result.status else '',result.error_message)
+        _log_query_error(result)
         return False
 
-    log_info.info('URL %s, body %s, status %s', url, str(data), result.status)
-    log_info.info('Response %s', result.response)
+    log_info.info('URL %s, body %s, status %s', url, Payload(data, Method.DBS_SET_STATUS), result.status)
+    log_info.info('Response %s', Payload(result.response, Method.DBS_SET_STATUS))
 
     order = result.response['order'] if 'order' in result.response else {}
     
@@ -692,12 +990,56 @@ def dbs_set_status(client_id: str, token: str, campaign_id: str, xml: list, data
 
     return strings_exist
 
+def _rank_delivery_offers(offers: list) -> list:
+    """Offers in confirmation order: time_interval delivery first, then the latest pickup interval end."""
+    ranked = []
+    for offer in offers:
+        details = offer['offer_details']
+        ranked.append(((details['delivery_interval']['policy'] == "time_interval", datetime.fromisoformat(details['pickup_interval']['max'][:19]).timestamp()), offer))
+    ranked.sort(key=lambda ranked_offer: ranked_offer[0], reverse=True)
+    return [offer for _, offer in ranked]
+
+def _confirm_delivery_offer(candidates: list, race: int, headers):
+    """Confirm the best offer that has not expired, trying race candidates at once.
+
+    Returns (offer, result, error_data); offer is empty when nothing could be confirmed. Extra
+    requests created by a race are cancelled so that only the best confirmed offer remains.
+    """
+    url = f"{host_delivery}/api/b2b/platform/offers/confirm"
+    result, error_data = None, {}
+    for start in range(0, len(candidates), race):
+        group = candidates[start:start + race]
+        if len(group) == 1:
+            results = [post_query(url, {'offer_id': group[0]['offer_id']}, headers)]
+        else:
+            with ThreadPoolExecutor(max_workers=len(group)) as executor:
+                results = list(executor.map(lambda offer: post_query(url, {'offer_id': offer['offer_id']}, headers), group))
+
+        confirmed = [(offer, offer_result) for offer, offer_result in zip(group, results) if offer_result.success]
+        for offer, offer_result in confirmed[1:]:
+            log_info.info('Cancelling extra confirmed offer %s', offer['offer_id'])
+            if 'request_id' in offer_result.response:
+                _post_without_xml(f"{host_delivery}/api/b2b/platform/request/cancel", {'request_id': offer_result.response['request_id']}, headers)
+        if confirmed:
+            return dict(confirmed[0][0]), confirmed[0][1], {}
+
+        for offer, offer_result in zip(group, results):
+            result = offer_result
+            try:
+                error_data = json.loads(offer_result.data)
+            except Exception as ex:
+                error_data = {}
+            if not ((offer_result.status == 404 or offer_result.status == 500) and 'message' in error_data):
+                return {}, result, error_data
+            log_info.info('Offer %s expired: %s', offer['offer_id'], error_data['message'])
+    return {}, result, error_data
+
 def yd_create_offer(client_id: str, token: str, campaign_id: str, xml: list, data) -> bool:
     headers = {'Content-Type': 'application/json', 'Cache-Control': 'no-cache', 'Authorization': f'Bearer {token}'}
     strings_exist = False
     url = f"{host_delivery}/api/b2b/platform/offers/create"
     
-    result = post_query(url, data, headers)
+    result = post_query(url, {key: value for key, value in data.items() if key != 'confirm_race'}, headers)
     if not result.success:
         try:
             error_data = json.loads(result.data)
@@ -714,69 +1056,35 @@ def yd_create_offer(client_id: str, token: str, campaign_id: str, xml: list, dat
             except Exception as ex:
                 log_error.error('%s', str(ex))
                 return False
-        elif result.data:
-            log_error.error('Status: %s. Error: %s',result.status,result.data)
         else:
-            log_error.error('%s%s',('Status: ' + result.status +'. ') if result.status else '',result.error_message)
+            _log_query_error(result)
         return False
 
     #все норм и предложены варианты
     
-    log_info.info('Response %s', result.response)
-
-    response_data = dict(result.response)
+    log_info.info('Response %s', Payload(result.response, Method.YD_CREATE_OFFER))
 
-    latest_date = 0
-    delivery_to_time_interval = False
-    result_offer = {}    
-    for offer in response_data['offers']:
-        max_date = datetime.fromisoformat(offer['offer_details']['pickup_interval']['max'][:19]).timestamp()
-
-        if delivery_to_time_interval:
-            if offer['offer_details']['delivery_interval']['policy'] == "time_interval":
-                if max_date > latest_date:
-                    latest_date = max_date
-                    result_offer = dict(offer)
-                continue
-        
-        if offer['offer_details']['delivery_interval']['policy'] == "time_interval":
-            latest_date = max_date
-            result_offer = dict(offer)
-            delivery_to_time_interval = True
-        else:
-            if max_date > latest_date:
-                latest_date = max_date
-                result_offer = dict(offer)
-            delivery_to_time_interval = False
-
-
-    if result_offer:
-        url = f"{host_delivery}/api/b2b/platform/offers/confirm"
-        
-        body = {'offer_id': result_offer['offer_id']}
+    candidates = _rank_delivery_offers(result.response['offers'] if 'offers' in result.response else [])
+    if not candidates:
+        log_error.error('No delivery offers for %s', data['info']['operator_request_id'])
+        return False
 
-        result = post_query(url, body, headers)
-        if not result.success:
+    race = int(data['confirm_race']) if 'confirm_race' in data and str(data['confirm_race']).isdigit() else 1
+    result_offer, result, error_data = _confirm_delivery_offer(candidates, max(race, 1), headers)
+    if not result_offer:
+        if result is not None and (result.status == 404 or result.status == 500) and 'message' in error_data:
             try:
-                error_data = json.loads(result.data)
+                xml.append('<?xml version="1.0" encoding="windows-1251"?>')
+                error_data['operator_request_id'] = data['info']['operator_request_id']
+                json_to_xml(Method.YD_CREATE_OFFER, error_data, xml)
+                strings_exist = True
+                return True
             except Exception as ex:
-                error_data = {}
-            
-            if (result.status == 404 or result.status == 500) and 'message' in error_data:
-                try:
-                    xml.append('<?xml version="1.0" encoding="windows-1251"?>')
-                    error_data['operator_request_id'] = data['info']['operator_request_id']
-                    json_to_xml(Method.YD_CREATE_OFFER, error_data, xml)
-                    strings_exist = True
-                    return True
-                except Exception as ex:
-                    log_error.error('%s', str(ex))
-                    return False
-            elif result.data:
-                log_error.error('Status: %s. Error: %s',result.status,result.data)
-            else:
-                log_error.error('%s%s',('Status: ' + result.status +'. ') if result.status else '',result.error_message)
-            return False
+                log_error.error('%s', str(ex))
+                return False
+        if result is not None:
+            _log_query_error(result)
+        return False
 
     response_data = dict(result.response)
     try:
@@ -795,7 +1103,10 @@ def yd_create_offer(client_id: str, token: str, campaign_id: str, xml: list, dat
     return strings_exist
 
 def yd_cancel_offer(client_id: str, token: str, campaign_id: str, xml: list, data) -> bool:
-    if _post_without_xml(f"{host_delivery}/api/b2b/platform/request/cancel", data, {'Content-Type': 'application/json', 'Cache-Control': 'no-cache', 'Authorization': f'Bearer {token}'}):
+    cancelled = _post_without_xml(f"{host_delivery}/api/b2b/platform/request/cancel", data, {'Content-Type': 'application/json', 'Cache-Control': 'no-cache', 'Authorization': f'Bearer {token}'})
+    if response_cache:
+        response_cache.invalidate('', data['request_id'], (Method.YD_OFFER_INFO.value,))
+    if cancelled:
         try:
             xml.append('<?xml version="1.0" encoding="windows-1251"?>')
             response_data = {'request_id': data['request_id']}
@@ -811,28 +1122,18 @@ def yd_offer_info(client_id: str, token: str, campaign_id: str, xml: list, data)
     strings_exist = False
     url = f"{host_delivery}/api/b2b/platform/request/info?request_id={data['request_id']}"
     
-    result = get_query(url, headers)
+    result = _cached_get_query(Method.YD_OFFER_INFO, '', data['request_id'], url, headers)
     if not result.success:
-        if result.data:
-            log_error.error('Status: %s. Error: %s',result.status,result.data)
-        else:
-            log_error.error('%s%s',('Status: ' + result.status +'. ') if result.status else '',result.error_message)
+        _log_query_error(result)
         return False
 
     log_info.info('URL %s, status %s, response status %s', url, result.status, result.response['status'] if 'status' in result.response else '')
-    log_info.info('Response %s', result.response)
-
-    state = result.response['state'] if 'state' in result.response else {}
+    log_info.info('Response %s', Payload(result.response, Method.YD_OFFER_INFO))
 
-    param = 'total_without_vat'
-    if 'pricing' in result.response and 'price' in result.response['pricing'] and param in result.response['pricing']['price']:
-        state[param] = result.response['pricing']['price'][param]
+    state = _offer_state(data['request_id'], result.response)
 
     try:
         if state:
-            state['request_id'] = data['request_id']
-            if 'sharing_url' in result.response:
-                state['sharing_url'] = result.response['sharing_url']
             xml.append('<?xml version="1.0" encoding="windows-1251"?>')
             json_to_xml(Method.YD_OFFER_INFO, state, xml)
             strings_exist = True
@@ -842,6 +1143,91 @@ def yd_offer_info(client_id: str, token: str, campaign_id: str, xml: list, data)
 
     return strings_exist
 
+yd_terminal_statuses = ('DELIVERY_DELIVERED', 'FINISHED', 'CANCELLED', 'CANCELLED_BY_RECIPIENT', 'CANCELLED_IN_PLATFORM', 'RETURN_RETURNED')
+yd_poll_workers = 16
+
+def _offer_state(request_id, response: dict) -> dict:
+    state = dict(response['state']) if 'state' in response else {}
+    param = 'total_without_vat'
+    if 'pricing' in response and 'price' in response['pricing'] and param in response['pricing']['price']:
+        state[param] = response['pricing']['price'][param]
+    if state:
+        state['request_id'] = request_id
+        if 'sharing_url' in response:
+            state['sharing_url'] = response['sharing_url']
+    return state
+
+async def _poll_delivery_requests(request_ids: list, headers, min_interval: float, max_interval: float, deadline: float, terminal: tuple, on_cycle: Callable):
+    """Poll request states until all of them reach a terminal status or the deadline passes.
+
+    A request that changed is polled again after min_interval; each unchanged poll doubles its
+    interval up to max_interval. on_cycle gets the list of states that changed in one cycle.
+    """
+    loop = asyncio.get_event_loop()
+    executor = ThreadPoolExecutor(max_workers=yd_poll_workers)
+    statuses = {request_id: None for request_id in request_ids}
+    intervals = {request_id: min_interval for request_id in request_ids}
+    due = {request_id: 0.0 for request_id in request_ids}
+    try:
+        while due and time() < deadline:
+            now = time()
+            polled = [request_id for request_id in due if due[request_id] <= now]
+            results = await asyncio.gather(*(loop.run_in_executor(executor, get_query, f"{host_delivery}/api/b2b/platform/request/info?request_id={request_id}", headers) for request_id in polled))
+            changed = []
+            for request_id, result in zip(polled, results):
+                if not result.success:
+                    _log_query_error(result)
+                    intervals[request_id] = min(intervals[request_id] * 2, max_interval)
+                else:
+                    state = _offer_state(request_id, result.response)
+                    status = state['status'] if 'status' in state else None
+                    if status != statuses[request_id]:
+                        statuses[request_id] = status
+                        intervals[request_id] = min_interval
+                        if state:
+                            changed.append(state)
+                    else:
+                        intervals[request_id] = min(intervals[request_id] * 2, max_interval)
+                    if status in terminal:
+                        log_info.info('Request %s finished with status %s', request_id, status)
+                        del due[request_id]
+                        continue
+                due[request_id] = time() + intervals[request_id]
+            if changed:
+                on_cycle(changed)
+            if due:
+                await asyncio.sleep(max(0.0, min(min(due.values()), deadline) - time()))
+    finally:
+        executor.shutdown(wait=False)
+    return [request_id for request_id in due]
+
+def yd_poll_offers(client_id: str, token: str, campaign_id: str, xml: list, data) -> bool:
+    headers = {'Content-Type': 'application/json', 'Cache-Control': 'no-cache', 'Authorization': f'Bearer {token}'}
+    min_interval = float(data['min_interval']) if 'min_interval' in data else 30
+    max_interval = float(data['max_interval']) if 'max_interval' in data else 600
+    deadline = time() + (float(data['timeout']) if 'timeout' in data else 3600)
+    terminal = tuple(data['terminal_statuses']) if 'terminal_statuses' in data else yd_terminal_statuses
+    request_ids = [str(request_id) for request_id in data['request_ids']]
+    written = [False]
+
+    def write_cycle(states: list):
+        if 'params' in data:
+            for state in states:
+                _add_params_to_dict(data['params'], state)
+        if written[0] and hasattr(xml, 'rotate'):
+            log_info.info('Out file: %s', xml.rotate())
+        xml.append('<?xml version="1.0" encoding="windows-1251"?>')
+        xml.append('<yd-offers-info>')
+        json_to_xml(Method.YD_POLL_OFFERS, states, xml)
+        xml.append('</yd-offers-info>')
+        written[0] = True
+
+    left = asyncio.run(_poll_delivery_requests(request_ids, headers, min_interval, max_interval, deadline, terminal, write_cycle))
+    if left:
+        log_info.info('Polling stopped with %s active requests', len(left))
+
+    return written[0]
+
 
 def _add_params_to_dict(params: dict, destination: dict):
     for param in params.keys():                    
@@ -852,111 +1238,506 @@ functions = {
     Method.FBY_GET_ORDERS: (fby_get_orders, 'yafby_'),
     Method.FBS_SET_STATUS: (fbs_set_status, 'ymt_'),
     Method.FBS_SET_BOXES: (fbs_set_boxes, 'ymb_'),
+    Method.FBS_SET_BOXES_BULK: (fbs_set_boxes_bulk, 'ymbb_'),
     Method.GET_ORDER_INFO: (get_order_info, 'ymt_'),
+    Method.GET_ORDERS_INFO: (get_orders_info, 'ymtb_'),
     Method.GET_BUYER_INFO: (get_buyer_info, 'ymbi_'),
     Method.SET_PRICES: (set_prices, 'ypr_'),
     Method.DBS_GET_ORDERS_FOR_CANCELLATION_APPROVE: (dbs_get_orders_for_cancellation_approve, 'yadbs_'),
     Method.DBS_CANCELLATION_ACCEPT: (dbs_cancellation_accept, ''),
     Method.DBS_SET_TRACK: (dbs_set_track, ''),
     Method.DBS_SET_STATUS: (dbs_set_status, 'ymt_'),
+    Method.ORDERS_SET_STATUS: (orders_set_status, 'ymts_'),
     Method.DBS_CHANGE_DATE: (dbs_change_date, 'yachd_'),
     Method.YD_CREATE_OFFER: (yd_create_offer, 'ydcr_'),
     Method.YD_CANCEL_OFFER: (yd_cancel_offer, 'ydca_'),
-    Method.YD_OFFER_INFO: (yd_offer_info, 'ydgi_')
+    Method.YD_OFFER_INFO: (yd_offer_info, 'ydgi_'),
+    Method.YD_POLL_OFFERS: (yd_poll_offers, 'ydgi_')
     }
 
-def _execute_method(client_id: str, token: str, campaign_id: str, func_method: Callable, xml_prefix: str, func_data: dict) -> bool:
-    response_xml = []
+_file_numbers = itertools.count(1)
+
+def _out_file_name(file_path: str, xml_prefix: str) -> str:
+    """prefix + time, pid and a per-process counter, so concurrent processes and threads never share a name.
+    The random tail covers several hosts writing into one directory."""
+    return os.path.join(file_path, '%s%s_%s_%s_%s.xml' % (xml_prefix, datetime.now().strftime('%Y%m%d%H%M%S'), os.getpid(), next(_file_numbers), random_string(4)))
+
+manifest = None
+
+def _configure_manifest(path: str):
+    global manifest
+    manifest = Manifest(path) if path else None
+
+def _record_manifest(entries: list):
+    if manifest:
+        for entry in entries:
+            manifest.record(entry)
+
+def _execute_method(client_id: str, token: str, campaign_id: str, func_method: Callable, xml_prefix: str, func_data: dict, file_path: str, written: list = None) -> bool:
+    if not metrics.enabled:
+        return _run_method(client_id, token, campaign_id, func_method, xml_prefix, func_data, file_path, written)
+    metrics.method = func_method.__name__
+    start = perf_counter()
+    try:
+        result = _run_method(client_id, token, campaign_id, func_method, xml_prefix, func_data, file_path, written)
+    finally:
+        metrics.method = ''
+    metrics.observe('yandex_method_duration_seconds', perf_counter() - start, method=func_method.__name__)
+    metrics.inc('yandex_method_calls_total', method=func_method.__name__, result='ok' if result else 'error')
+    return result
+
+def _run_method(client_id: str, token: str, campaign_id: str, func_method: Callable, xml_prefix: str, func_data: dict, file_path: str, written: list = None) -> bool:
     write_xml = False
 
+    if xml_prefix:
+        try:
+            #при сборе нескольких кампаний в один файл запись в манифест делает _merge_outputs
+            defer_manifest = written is not None and Method(func_method.__name__) in merge_roots
+            response_xml = XmlSink(_out_file_name(file_path, xml_prefix), name_factory=lambda: _out_file_name(file_path, xml_prefix),
+                                   meta={'method': func_method.__name__, 'campaign': str(campaign_id)},
+                                   params={'campaign': str(campaign_id)} if written is not None else None,
+                                   manifest=None if defer_manifest or not manifest else manifest.record)
+        except Exception as e:
+            log_error.error('Write error: %s', str(e))
+            return False
+    else:
+        response_xml = []
+
     try:
         write_xml = func_method(client_id, token, campaign_id, response_xml, func_data)
     except Exception as e:
         log_error.error('Method error: %s', str(e))
+        if xml_prefix:
+            response_xml.discard()
+            if written is not None:
+                written.extend(response_xml.entries)
         return False
 
-    if write_xml:
-        if xml_prefix:
-            out_file = os.path.join(file_path, xml_prefix + random_string(8-len(xml_prefix)) + '.xml')
-            log_info.info('Out file: %s', out_file)
+    if xml_prefix:
+        if not write_xml:
+            response_xml.discard()
+        else:
+            log_info.info('Out file: %s', response_xml.out_file)
             try:
-                with open(out_file, "wb") as result_xml:
-                    result_xml.write('\n'.join(response_xml).encode('cp1251', errors='ignore'))
+                response_xml.commit()
             except Exception as e:
                 log_error.error('Write error: %s', str(e))
+                response_xml.discard()
                 return False
+        if response_xml.size:
+            metrics.inc('yandex_output_bytes_total', response_xml.size, method=func_method.__name__)
+        if written is not None:
+            written.extend(response_xml.entries)
     return True
 
 
-if __name__ == '__main__':
-    if len(sys.argv) < 2 or len(sys.argv) > 3:
-        log_error.error('Illegal arguments count!')
-        sys.exit(10)
+def _execute_chain(client_id: str, token: str, campaign_id: str, execute_requests: list, file_path: str, written: list = None) -> bool:
+    execute_result = True
+    is_not_required = False
+    pause_before = 0
 
-    function_data = []
-    not_delete = False
-    delete_anyway = False
-    delete_before_execution = False
+    for single_request in execute_requests:
+        if not execute_result and not is_not_required: #цепочка запросов до 1-й ошибки в обязательном запросе
+            break
+        is_not_required = True if 'is_not_required' in single_request and single_request['is_not_required']==1 else False
+        pause_before = int(single_request['pause_before']) if 'pause_before' in single_request and str(single_request['pause_before']).isdigit() else 0
+        function_data = single_request['data'] if 'data' in single_request else []
+        
+        if pause_before > 0:
+            if pause_before > 180:
+                pause_before = 180
+            print(f"Pause {pause_before} seconds")
+            sleep(pause_before)
+        try:
+            method = Method(single_request['method'])
+        except Exception as e:
+            log_error.error('Request error: %s', str(e) if 'method' in single_request else 'no method')
+            execute_result = False
+            continue
+        out_entries = [] if written is not None else None
+        execute_result =_execute_method(client_id, token, campaign_id, *functions[method], function_data, file_path, out_entries)
+        if written is not None:
+            written.extend((method, entry) for entry in out_entries)
+
+    return execute_result
+
+
+def _execute_requests(client_id: str, token: str, campaign_id: str, execute_requests: list, parallel: int, file_path: str, written: list = None) -> bool:
+    if parallel > 1:
+        chains = {}
+        for index, single_request in enumerate(execute_requests):
+            chain = ('chain', str(single_request['chain'])) if 'chain' in single_request else ('request', index)
+            chains.setdefault(chain, []).append(single_request)
+        def execute_chain(chain: list) -> bool:
+            #ошибка в одной цепочке не останавливает остальные
+            try:
+                return _execute_chain(client_id, token, campaign_id, chain, file_path, written)
+            except Exception as e:
+                log_error.error('Chain error: %s', str(e))
+                return False
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            results = list(executor.map(execute_chain, chains.values()))
+        return all(results)
+    return _execute_chain(client_id, token, campaign_id, execute_requests, file_path, written)
+
+
+#корневые элементы документов-списков, которые можно объединить по всем кампаниям
+merge_roots = {
+    Method.FBY_GET_ORDERS: 'fby_orders',
+    Method.GET_ORDERS_INFO: 'orders',
+    Method.DBS_GET_ORDERS_FOR_CANCELLATION_APPROVE: 'dbs_orders_for_cancellation_approve',
+}
+
+def _merge_outputs(written: list, file_path: str):
+    """Join the per-campaign files of every list-rooted method into one document, streaming line by line.
+
+    Files of these methods are added to the manifest here: the merged file, or the parts when there is nothing to merge.
+    """
+    by_method = {}
+    for method, entry in written:
+        by_method.setdefault(method, []).append(entry)
+    for method, entries in by_method.items():
+        if method not in merge_roots:
+            continue
+        if len(entries) < 2:
+            _record_manifest(entries)
+            continue
+        root = merge_roots[method].encode('cp1251')
+        out_file = _out_file_name(file_path, functions[method][1])
+        temp_file = os.path.join(file_path, '.%s.tmp' % os.path.basename(out_file))
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(temp_file, 'xb') as merged:
+                def write(data: bytes):
+                    nonlocal size
+                    merged.write(data)
+                    digest.update(data)
+                    size += len(data)
+                write(b'<?xml version="1.0" encoding="windows-1251"?>\n<' + root + b'>')
+                for entry in entries:
+                    with open(os.path.join(file_path, entry['file']), 'rb') as part_file:
+                        for line in part_file:
+                            line = line.rstrip(b'\n')
+                            if line.startswith(b'<?xml') or line in (b'<' + root + b'>', b'</' + root + b'>'):
+                                continue
+                            write(b'\n' + line)
+                write(b'\n</' + root + b'>')
+                merged.flush()
+                os.fsync(merged.fileno())
+            os.replace(temp_file, out_file)
+        except Exception as e:
+            log_error.error('Merge error: %s', str(e))
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            _record_manifest(entries)
+            continue
+        log_info.info('Merged %s files into %s', len(entries), out_file)
+        for entry in entries:
+            os.remove(os.path.join(file_path, entry['file']))
+        order_ids = list(dict.fromkeys(order_id for entry in entries for order_id in entry['orders']))
+        _record_manifest([{'method': method.value, 'campaign': ','.join(entry['campaign'] for entry in entries),
+                           'file': os.path.basename(out_file), 'orders': order_ids, 'size': size, 'sha256': digest.hexdigest(),
+                           'time': datetime.now().isoformat(timespec='seconds')}])
+
+
+def _parse_config(raw: bytes):
+    """Config JSON as utf-8, or cp1251 when it is not valid utf-8 JSON."""
+    try:
+        return json_codec.loads(raw.decode('utf-8'))
+    except Exception:
+        return json_codec.loads(raw.decode('cp1251'))
 
-    file_path = sys.argv[2] if len(sys.argv) == 3 else os.path.dirname(sys.argv[1])
-    
+
+own_files = set() #файлы, на которые ссылаются выполненные конфиги (состояние, манифест, входные данные): --watch не запускает их как задания
+own_files_name = '.yandex_own_files' #список own_files в каталоге --watch, переживает перезапуск
+
+def _config_files(value) -> set:
+    """Absolute paths of the .cfg/.json/.jsonl files a config refers to anywhere in its values."""
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        return set().union(*map(_config_files, value)) if value else set()
+    if isinstance(value, str) and value.endswith(watch_extensions):
+        return {os.path.abspath(value)}
+    return set()
+
+
+def run_job(config: dict, file_path: str, before_execution: Callable = None) -> int:
+    """Execute one parsed config, returns the exit code (0, 20 or 30). Where the config came from is up to the caller."""
     try:
-        try:
-            config = json.load(open(sys.argv[1], 'r', encoding='utf-8'))
-        except Exception:
-            config = json.load(open(sys.argv[1], 'r', encoding='cp1251'))
-            
-        CLIENT_ID = config['client_id']
-        TOKEN = config['token']
-        CAMPAIGN_ID = config['campaign_id']
-        not_delete = config['not_delete'] if 'not_delete' in config else False
-        delete_anyway = config['delete_anyway'] if 'delete_anyway' in config else False
-        delete_before_execution = config['delete_before_execution'] if 'delete_before_execution' in config else False
+        campaigns = []
+        if 'campaigns' in config and config['campaigns']:
+            for campaign in config['campaigns']:
+                campaigns.append((campaign['client_id'] if 'client_id' in campaign else config['client_id'],
+                                  campaign['token'] if 'token' in campaign else config['token'],
+                                  str(campaign['campaign_id'])))
+        else:
+            campaigns.append((config['client_id'], config['token'], config['campaign_id']))
+        campaign_parallel = int(config['campaign_parallel']) if 'campaign_parallel' in config and str(config['campaign_parallel']).isdigit() else 4
+
+        parallel = int(config['parallel']) if 'parallel' in config and str(config['parallel']).isdigit() else 0
 
         if 'xml_path' in config and config['xml_path']:
             file_path = config['xml_path']
 
+        transport.configure(settings_from_config(config))
+
+        _configure_response_cache(config['response_cache'] if 'response_cache' in config else None)
+
+        metrics.configure(config['metrics'] if 'metrics' in config else None)
+
+        configure_logging(config['logging'] if 'logging' in config else None)
+
+        json_codec.use(config['json_codec'] if 'json_codec' in config else 'auto')
+
+        _configure_manifest(config['manifest'] if 'manifest' in config else None)
+
+        set_unicode_replace(config['unicode_replace'] if 'unicode_replace' in config else None)
+
         execute_requests = []
         if not isinstance(config['request'], list):
             execute_requests.append(config['request'])
         else:
             execute_requests = config['request']
+
+        own_files.update(_config_files(config))
+        if metrics.enabled:
+            own_files.add(os.path.abspath(metrics.file + '.json'))
     except Exception as e:
         log_error.error('Read config error: ' + str(e))
-        sys.exit(20)
+        return 20
+
+    if before_execution:
+        before_execution()
+
+    if 'campaigns' in config and config['campaigns']:
+        written = []
+        def execute_campaign(campaign):
+            client_id, token, campaign_id = campaign
+            result = _execute_requests(client_id, token, campaign_id, execute_requests, parallel, file_path, written)
+            log_info.info('Campaign %s finished: %s', campaign_id, 'OK' if result else 'ERROR')
+            return result
+        with ThreadPoolExecutor(max_workers=max(campaign_parallel, 1)) as executor:
+            results = list(executor.map(execute_campaign, campaigns))
+        _merge_outputs(written, file_path)
+        execute_result = all(results)
+    else:
+        CLIENT_ID, TOKEN, CAMPAIGN_ID = campaigns[0]
+        execute_result = _execute_requests(CLIENT_ID, TOKEN, CAMPAIGN_ID, execute_requests, parallel, file_path)
 
-    if delete_before_execution:
-        if os.path.exists(sys.argv[1]):
-            os.remove(sys.argv[1])
 
-    execute_result = True
-    is_not_required = False
-    pause_before = 0
+    try:
+        metrics.export()
+    except Exception as e:
+        log_error.error('Metrics error: %s', str(e))
+
+    return 0 if execute_result else 30
 
-    for single_request in execute_requests:
-        if not execute_result and not is_not_required: #цепочка запросов до 1-й ошибки в обязательном запросе
-            break
-        method = single_request['method']
-        is_not_required = True if 'is_not_required' in single_request and single_request['is_not_required']==1 else False
-        pause_before = int(single_request['pause_before']) if 'pause_before' in single_request and str(single_request['pause_before']).isdigit() else 0
-        function_data = single_request['data'] if 'data' in single_request else []
-        
-        if pause_before > 0:
-            if pause_before > 180:
-                pause_before = 180
-            print(f"Pause {pause_before} seconds")
-            sleep(pause_before)
-        execute_result =_execute_method(CLIENT_ID, TOKEN, CAMPAIGN_ID, *functions[Method(method)], function_data)
+
+def run_config(config_file: str, file_path: str = None) -> int:
+    """Execute one config file, returns the process exit code (0, 20 or 30)."""
+    not_delete = False
+    delete_anyway = False
+    delete_before_execution = False
+
+    if file_path is None:
+        file_path = os.path.dirname(config_file)
+
+    try:
+        with open(config_file, 'rb') as config_data:
+            config = _parse_config(config_data.read())
+        not_delete = config['not_delete'] if 'not_delete' in config else False
+        delete_anyway = config['delete_anyway'] if 'delete_anyway' in config else False
+        delete_before_execution = config['delete_before_execution'] if 'delete_before_execution' in config else False
+    except Exception as e:
+        log_error.error('Read config error: ' + str(e))
+        return 20
+
+    def remove_config():
+        if os.path.exists(config_file):
+            os.remove(config_file)
+
+    exit_code = run_job(config, file_path, remove_config if delete_before_execution else None)
+    if exit_code == 20:
+        return 20
 
     if not delete_before_execution and delete_anyway:
-        if os.path.exists(sys.argv[1]):
-            os.remove(sys.argv[1])
+        remove_config()
 
-    if not execute_result:
-        sys.exit(30)
+    if exit_code:
+        return exit_code
 
     if not delete_before_execution and not delete_anyway and not not_delete: #если уже точно не удалено, то удалять, если нет особых указаний
-        if os.path.exists(sys.argv[1]):
-            os.remove(sys.argv[1])
+        remove_config()
+
+    return 0
+
+
+spool_extensions = ('.jsonl',)
+
+def _done_jobs(results_file: str) -> set:
+    """(line, sha256) of jobs the results file already records as successful."""
+    done = set()
+    if not os.path.exists(results_file):
+        return done
+    with open(results_file, 'rb') as results:
+        for line in results:
+            try:
+                result = json_codec.loads(line)
+            except Exception:
+                continue
+            if isinstance(result, dict) and 'code' in result and result['code'] == 0 and 'sha256' in result:
+                done.add((result['line'], result['sha256']))
+    return done
+
+def run_spool(spool_file: str, file_path: str = None, results_file: str = None) -> int:
+    """Execute a JSON Lines spool, one config (job) per line, in this process with shared connections.
+
+    Lines are read and run one at a time; every finished job appends {"line", "sha256", "job_id", "code", "seconds"}
+    to results_file (spool_file + '.results' by default). Lines already recorded there with code 0 are skipped,
+    so running a kept spool again repeats only the failed jobs. The spool is removed afterwards unless a job
+    has not_delete or failed without delete_anyway. Returns 0, 30 when any job failed, 20 when the spool can't be read.
+    """
+    if file_path is None:
+        file_path = os.path.dirname(spool_file)
+    if results_file is None:
+        results_file = spool_file + '.results'
+
+    failed = False
+    keep = False
+    try:
+        done = _done_jobs(results_file)
+        spool = open(spool_file, 'rb')
+        results = open(results_file, 'ab')
+    except Exception as e:
+        log_error.error('Read spool error: %s', str(e))
+        return 20
+
+    with spool, results:
+        for number, line in enumerate(spool, 1):
+            line = line.strip()
+            if not line:
+                continue
+            started = time()
+            digest = hashlib.sha256(line).hexdigest()
+            try:
+                job = _parse_config(line)
+                if not isinstance(job, dict):
+                    raise ValueError('job is not an object')
+            except Exception as e:
+                log_error.error('Spool %s line %s: %s', spool_file, number, str(e))
+                job = {}
+                exit_code = 20
+            else:
+                if (number, digest) in done:
+                    log_info.info('Spool %s line %s already done', spool_file, number)
+                    if 'not_delete' in job and job['not_delete']:
+                        keep = True
+                    continue
+                try:
+                    exit_code = run_job(job, file_path)
+                except Exception as e:
+                    #ошибка одного задания не останавливает остальные
+                    log_error.error('Spool %s line %s error: %s', spool_file, number, str(e))
+                    exit_code = 30
+            if exit_code:
+                failed = True
+                log_error.error('Spool %s line %s failed with code %s', spool_file, number, exit_code)
+                if not ('delete_anyway' in job and job['delete_anyway']):
+                    keep = True
+            if 'not_delete' in job and job['not_delete']:
+                keep = True
+            result = {'line': number, 'sha256': digest, 'job_id': job['job_id'] if 'job_id' in job else None, 'code': exit_code, 'seconds': round(time() - started, 3)}
+            results.write(json_codec.dumps(result) + b'\n')
+            results.flush()
+            log_info.info('Spool %s line %s finished with code %s', spool_file, number, exit_code)
+
+    if not keep and os.path.exists(spool_file):
+        os.remove(spool_file)
+    return 30 if failed else 0
+
+
+watch_extensions = ('.cfg', '.json') + spool_extensions
+watch_interval = 1.0
+watch_settle = 0.5
+
+def _load_own_files(registry: str):
+    try:
+        with open(registry, 'r', encoding='utf-8') as registry_file:
+            own_files.update(json.load(registry_file))
+    except (OSError, ValueError):
+        pass
+
+def _save_own_files(registry: str):
+    with open(registry, 'w', encoding='utf-8') as registry_file:
+        json.dump(sorted(own_files), registry_file)
+
+def watch_directory(spool_path: str, file_path: str = None):
+    """Resident mode: run every config dropped into spool_path, keeping connections warm between jobs."""
+    processed = {}
+    registry = os.path.join(spool_path, own_files_name)
+    _load_own_files(registry)
+    saved = len(own_files)
+    log_info.info('Watching %s', spool_path)
+    try:
+        while True:
+            now = time()
+            present = set()
+            for name in sorted(os.listdir(spool_path)):
+                if not name.endswith(watch_extensions):
+                    continue
+                config_file = os.path.join(spool_path, name)
+                if os.path.abspath(config_file) in own_files:
+                    continue
+                try:
+                    stat = os.stat(config_file)
+                except OSError:
+                    continue
+                present.add(config_file)
+                signature = (stat.st_mtime, stat.st_size)
+                if processed.get(config_file) == signature or now - stat.st_mtime < watch_settle:
+                    continue
+                started = time()
+                processed[config_file] = signature
+                try:
+                    exit_code = run_spool(config_file, file_path) if name.endswith(spool_extensions) else run_config(config_file, file_path)
+                except Exception as e:
+                    #сервис продолжает работу, задание с той же подписью повторно не запускается
+                    log_error.error('Job %s error: %s', config_file, str(e))
+                    continue
+                log_info.info('Job %s finished with code %s in %.3f s', config_file, exit_code, time() - started)
+                if exit_code:
+                    log_error.error('Job %s failed with code %s', config_file, exit_code)
+            if len(own_files) != saved:
+                try:
+                    _save_own_files(registry)
+                    saved = len(own_files)
+                except Exception as e:
+                    log_error.error('Own files error: %s', str(e))
+            for config_file in list(processed):
+                if config_file not in present:
+                    del processed[config_file]
+            sleep(watch_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        transport.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == '--watch':
+        if len(sys.argv) > 4:
+            log_error.error('Illegal arguments count!')
+            sys.exit(10)
+        watch_directory(sys.argv[2], sys.argv[3] if len(sys.argv) == 4 else None)
+        sys.exit(0)
+
+    if len(sys.argv) < 2 or len(sys.argv) > 3:
+        log_error.error('Illegal arguments count!')
+        sys.exit(10)
 
+    if sys.argv[1].endswith(spool_extensions):
+        sys.exit(run_spool(sys.argv[1], sys.argv[2] if len(sys.argv) == 3 else None))
 
+    sys.exit(run_config(sys.argv[1], sys.argv[2] if len(sys.argv) == 3 else None))